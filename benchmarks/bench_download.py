@@ -0,0 +1,66 @@
+import argparse
+import functools
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import write_synthetic_csv
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss в Linux отдаётся в КиБ
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(url: str, filename: str) -> None:
+    from main import download_file
+
+    before = peak_rss_mib()
+    download_file(filename, url = url)
+    print(f'{before:.1f} {peak_rss_mib():.1f}')
+
+
+def run(rows_list: list[int]) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        handler = functools.partial(QuietHandler, directory = temp_dir)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        host, port = server.server_address
+
+        print(f'{"rows":>10} {"size MiB":>10} {"rss before":>11} {"rss peak":>10}')
+        for rows in rows_list:
+            source = os.path.join(temp_dir, f'DEF-{rows}.csv')
+            size = write_synthetic_csv(source, rows)
+            target = os.path.join(temp_dir, f'downloaded-{rows}.csv')
+
+            # Каждое скачивание в отдельном процессе, чтобы пиковый RSS не копился между замерами
+            result = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_download', '--child', f'http://{host}:{port}/DEF-{rows}.csv', target],
+                capture_output = True, text = True, check = True,
+            )
+            before, peak = result.stdout.split()
+            print(f'{rows:>10} {size / 1024 / 1024:>10.1f} {before:>11} {peak:>10}')
+
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Peak RSS of download_file against a local HTTP server')
+    parser.add_argument('--rows', nargs = '+', type = int, default = [100_000, 500_000, 2_000_000])
+    parser.add_argument('--child', nargs = 2, metavar = ('URL', 'FILENAME'), help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+    else:
+        run(args.rows)
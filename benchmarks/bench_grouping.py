@@ -0,0 +1,41 @@
+import argparse
+import time
+
+from cfg import PatternLine, get_default_operators
+from main import grouping_lines
+
+
+def legacy_get_operator_to_inn(inn: str) -> str:
+    # Старая реализация: обратный словарь строится на каждый вызов
+    operators = get_default_operators()
+    reverse_mapping = {inn: name for name, inn in operators.items()}
+    return reverse_mapping.get(inn)
+
+
+def run(lines_count: int) -> None:
+    inns = list(get_default_operators().values())
+    lines = [PatternLine(f'_[78]9{i % 100:02d}{i % 10000000:07d}', 'Оператор', inns[i % len(inns)]) for i in range(lines_count)]
+
+    started = time.perf_counter()
+    legacy = {}
+    for line in lines:
+        # Старый цикл grouping_lines: поиск оператора на каждую строку
+        legacy.setdefault(legacy_get_operator_to_inn(line.inn), []).append(f'exten = {line.pattern},1,GoSub')
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    current = grouping_lines(lines)
+    current_time = time.perf_counter() - started
+
+    assert current == legacy
+    print(f'lines={lines_count}')
+    print(f'reverse map per line {legacy_time:.3f}s')
+    print(f'operator registry    {current_time:.3f}s ({legacy_time / current_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'grouping_lines with per-line reverse map versus OperatorRegistry')
+    parser.add_argument('--lines', type = int, default = 500_000)
+    args = parser.parse_args()
+
+    run(args.lines)
@@ -0,0 +1,67 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import get_operator_registry, logger
+from main import get_selected_inns, grouping_lines, parsing_rows, read_csv_file_fast
+from optimized import optimize_patterns_in_memory, parse_pattern
+
+
+def measure(raw_data: list[list[str]], operators: list[str], level: int) -> dict[str, float]:
+    logger.setLevel(level)
+    timings = {}
+
+    started = time.perf_counter()
+    grouped = grouping_lines(parsing_rows(raw_data, operators))
+    timings['parse'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for patterns in grouped.values():
+        optimize_patterns_in_memory(patterns)
+    timings['optimize'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for patterns in grouped.values():
+        for pattern in patterns:
+            parse_pattern(pattern)
+    timings['parse_pattern'] = time.perf_counter() - started
+
+    return timings
+
+
+def run(rows: int) -> None:
+    operators = get_operator_registry().names()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'DEF-9xx.csv')
+        write_synthetic_csv(path, rows, aligned = True)
+        raw_data = list(read_csv_file_fast(path, get_selected_inns(operators)))
+
+    # Пишем в /dev/null, но через настоящий форматтер, чтобы DEBUG стоил как в жизни
+    handlers, level = logger.handlers[:], logger.level
+    with open(os.devnull, 'w', encoding = 'utf-8') as devnull:
+        stream = logging.StreamHandler(devnull)
+        stream.setFormatter(handlers[0].formatter)
+        logger.handlers[:] = [stream]
+        try:
+            info = measure(raw_data, operators, logging.INFO)
+            debug = measure(raw_data, operators, logging.DEBUG)
+
+        finally:
+            logger.handlers[:] = handlers
+            logger.setLevel(level)
+
+    print(f'rows={rows}')
+    print(f'{"stage":<15} {"INFO":>8} {"DEBUG":>8}')
+    for stage in info:
+        print(f'{stage:<15} {info[stage]:>8.3f} {debug[stage]:>8.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Parser and optimizer time with logging at INFO versus DEBUG')
+    parser.add_argument('--rows', type = int, default = 50_000)
+    args = parser.parse_args()
+
+    run(args.rows)
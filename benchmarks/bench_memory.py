@@ -0,0 +1,67 @@
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import RowData, get_operator_registry
+from main import get_selected_inns, grouping_lines, parsing_rows, range_of_numbers, read_csv_file_fast
+
+
+@dataclass
+class LegacyPatternLine:
+    # Прежнее представление: обычный dataclass с __dict__ на каждый объект
+    pattern: str
+    operator_name: str
+    inn: str
+
+
+def legacy_parsing_rows(raw_data: list[list[str]], selected_operators: list[str]) -> list[LegacyPatternLine]:
+    selected_inns = get_selected_inns(selected_operators)
+    all_data = []
+    for row in raw_data:
+        if row[4] in selected_inns:
+            for line in range_of_numbers(RowData(*row)):
+                all_data.append(LegacyPatternLine(line.pattern, row[3], row[4]))
+
+    return all_data
+
+
+def measure(name: str, func) -> object:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<14} lines={len(result):>9} retained={current / 1024 / 1024:>8.1f}MiB peak={peak / 1024 / 1024:>8.1f}MiB {elapsed:.2f}s')
+    return result
+
+
+def run(rows: int) -> None:
+    operators = get_operator_registry().names()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'DEF-9xx.csv')
+        write_synthetic_csv(path, rows)
+        # Строки csv читаем заранее, чтобы мерить только хранение PatternLine
+        raw_data = list(read_csv_file_fast(path, get_selected_inns(operators)))
+
+    print(f'rows={rows}')
+    legacy = measure('dataclass', lambda: legacy_parsing_rows(raw_data, operators))
+    del legacy
+    compact = measure('PatternLines', lambda: parsing_rows(raw_data, operators))
+
+    measure('grouping', lambda: grouping_lines(compact))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'tracemalloc of list[PatternLine] versus PatternLines')
+    parser.add_argument('--rows', type = int, default = 100_000)
+    args = parser.parse_args()
+
+    run(args.rows)
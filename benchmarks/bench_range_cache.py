@@ -0,0 +1,44 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import RowData, get_operator_registry
+from main import cached_decompose_range, get_selected_inns, range_patterns, read_csv_file_fast
+from ranges import decompose_range
+
+
+def run(rows: int, aligned: bool) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'DEF-9xx.csv')
+        write_synthetic_csv(path, rows, aligned = aligned)
+        raw_data = list(read_csv_file_fast(path, get_selected_inns(get_operator_registry().names())))
+
+    parsed_rows = [RowData(*row) for row in raw_data]
+
+    started = time.perf_counter()
+    for row in parsed_rows:
+        decompose_range(row.start_input, row.end_input, 7)
+    plain_time = time.perf_counter() - started
+
+    cached_decompose_range.cache_clear()
+    started = time.perf_counter()
+    for row in parsed_rows:
+        range_patterns(row)
+    cached_time = time.perf_counter() - started
+
+    info = cached_decompose_range.cache_info()
+    print(f'rows={len(parsed_rows)} aligned={aligned}')
+    print(f'hits={info.hits} misses={info.misses} hit rate {info.hits / (info.hits + info.misses) * 100:.1f}%')
+    print(f'decompose_range   {plain_time:.3f}s')
+    print(f'cached            {cached_time:.3f}s ({plain_time / cached_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Hit rate and speedup of the range decomposition cache')
+    parser.add_argument('--rows', type = int, default = 200_000)
+    parser.add_argument('--uniform', action = 'store_true', help = 'old synthetic ranges instead of registry-like aligned blocks')
+    args = parser.parse_args()
+
+    run(args.rows, not args.uniform)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import get_default_operators
+from main import read_csv_file, read_csv_file_fast
+
+
+def measure(name: str, rows_total: int, func) -> list[list[str]]:
+    started = time.perf_counter()
+    result = list(func())
+    elapsed = time.perf_counter() - started
+    print(f'{name:<8} {elapsed:8.2f}s {rows_total / elapsed:>12,.0f} rows/s  matched={len(result)}')
+    return result
+
+
+def run(rows: int, operators: list[str]) -> None:
+    inns = [get_default_operators()[name] for name in operators]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'DEF-9xx.csv')
+        write_synthetic_csv(path, rows)
+        print(f'rows={rows} operators={operators}')
+
+        old = measure('csv', rows, lambda: (row for row in read_csv_file(path) if row[4] in inns))
+        new = measure('mmap', rows, lambda: read_csv_file_fast(path, inns))
+
+    assert old == new
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'read_csv_file versus read_csv_file_fast')
+    parser.add_argument('--rows', type = int, default = 1_000_000)
+    parser.add_argument('--names', nargs = '+', default = ['mts'])
+    args = parser.parse_args()
+
+    run(args.rows, args.names)
@@ -0,0 +1,36 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import STRATEGIES, get_operator_registry
+from main import get_selected_inns, optimize_parsed, parse_rows, read_csv_file_fast
+
+
+def run(rows: int, operators: list[str], optimization_lvl: int | None, workers: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'DEF-9xx.csv')
+        write_synthetic_csv(path, rows)
+        raw_data = list(read_csv_file_fast(path, get_selected_inns(operators)))
+
+    print(f'rows={rows} matched={len(raw_data)} optimization_lvl={optimization_lvl} workers={workers}')
+    print(f'{"strategy":<10} {"lines":>10} {"seconds":>10}')
+    for strategy in STRATEGIES:
+        started = time.perf_counter()
+        result = optimize_parsed(parse_rows(raw_data, operators, strategy), strategy, optimization_lvl, workers)
+        elapsed = time.perf_counter() - started
+
+        lines = sum(len(patterns) for patterns in result.values())
+        print(f'{strategy:<10} {lines:>10} {elapsed:>10.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Line count and runtime of each pattern strategy')
+    parser.add_argument('--rows', type = int, default = 50_000)
+    parser.add_argument('--names', nargs = '+', default = get_operator_registry().names())
+    parser.add_argument('--lvl', type = int, default = None, help = 'optimizer cycles for passes, default: until converged')
+    parser.add_argument('--workers', type = int, default = 1, help = 'optimize operators in N processes')
+    args = parser.parse_args()
+
+    run(args.rows, args.names, args.lvl, args.workers)
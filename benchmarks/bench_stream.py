@@ -0,0 +1,80 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import write_synthetic_csv
+from cfg import get_default_operators
+from main import download_file, iter_csv_rows, parsing_rows, read_csv_file
+from streaming import open_registry_stream
+
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    # Имитируем медленный канал: отдаём файл блоками с паузой
+    def do_GET(self):
+        with open(self.server.path, 'rb') as f:
+            payload = f.read()
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+
+        block = 64 * 1024
+        delay = block / (self.server.speed * 1024 * 1024)
+        for i in range(0, len(payload), block):
+            self.wfile.write(payload[i:i + block])
+            time.sleep(delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(rows: int, speed: float) -> None:
+    operators = list(get_default_operators().keys())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, 'source.csv')
+        size = write_synthetic_csv(source, rows)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottledHandler)
+        server.path = source
+        server.speed = speed
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        host, port = server.server_address
+        url = f'http://{host}:{port}/DEF-9xx.csv'
+
+        target = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+        started = time.perf_counter()
+        download_file(target, url = url, use_cache = False)
+        downloaded = time.perf_counter()
+        sequential_lines = parsing_rows(read_csv_file(target), operators)
+        finished = time.perf_counter()
+
+        download_time = downloaded - started
+        parse_time = finished - downloaded
+
+        started = time.perf_counter()
+        with open_registry_stream(target, url, use_cache = False) as registry:
+            streamed_lines = parsing_rows(iter_csv_rows(registry.text()), operators)
+            registry.finish()
+        stream_time = time.perf_counter() - started
+
+        server.shutdown()
+        server.server_close()
+
+    assert len(streamed_lines) == len(sequential_lines)
+    print(f'rows={rows} size={size / 1024 / 1024:.1f}MiB link={speed}MiB/s')
+    print(f'download {download_time:.2f}s + parse {parse_time:.2f}s = {download_time + parse_time:.2f}s')
+    print(f'streaming {stream_time:.2f}s (max of stages {max(download_time, parse_time):.2f}s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Sequential download+parse versus streaming pipeline')
+    parser.add_argument('--rows', type = int, default = 300_000)
+    parser.add_argument('--speed', type = float, default = 5.0, help = 'link speed, MiB/s')
+    args = parser.parse_args()
+
+    run(args.rows, args.speed)
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import write_registry_csv
+from cfg import RowData, get_operator_registry
+from main import cached_decompose_range, grouping_lines, parsing_rows, range_of_numbers, read_csv_file, write_operator_config
+from metrics import RunReport, collect_stages
+from optimized import optimize_patterns_in_memory
+
+
+def run_once(path: str, operators: list[str], optimization_lvl: int | None, output_dir: str) -> dict[str, dict]:
+    # Каждый этап получает на вход готовый результат предыдущего и замеряется отдельно
+    report = RunReport()
+    selected_inns = {get_operator_registry().inn(name) for name in operators}
+
+    with report.stage('read_csv_file') as metrics:
+        raw_data = list(read_csv_file(path))
+        metrics.items_out = len(raw_data)
+
+    rows = [RowData(*row) for row in raw_data if row[4] in selected_inns]
+    cached_decompose_range.cache_clear()
+    with report.stage('range_of_numbers', len(rows)) as metrics:
+        metrics.items_out = sum(len(range_of_numbers(row)) for row in rows)
+
+    cached_decompose_range.cache_clear()
+    with report.stage('parsing_rows', len(raw_data)) as metrics:
+        parsed = parsing_rows(raw_data, operators)
+        metrics.items_out = len(parsed)
+
+    with report.stage('grouping_lines', len(parsed)) as metrics:
+        grouped = grouping_lines(parsed)
+        metrics.items_out = len(grouped)
+
+    # Проходы оптимизатора суммируются по всем циклам и операторам
+    passes: dict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+    optimized = {}
+    with report.stage('optimize', sum(len(lines) for lines in grouped.values())) as metrics:
+        for operator, lines in grouped.items():
+            with collect_stages() as stages:
+                optimized[operator] = optimize_patterns_in_memory(lines, optimization_lvl)
+
+            for pass_metrics in stages:
+                totals = passes[pass_metrics.name.split('/')[-1]]
+                totals[0] += pass_metrics.wall
+                totals[1] += pass_metrics.cpu
+
+        metrics.items_out = sum(len(lines) for lines in optimized.values())
+
+    with report.stage('write_operator_config', len(optimized)) as metrics:
+        write_operator_config(optimized, output_dir)
+        metrics.items_out = metrics.items_in
+
+    result = {
+        metrics.name: {'wall': metrics.wall, 'cpu': metrics.cpu, 'items_in': metrics.items_in, 'items_out': metrics.items_out}
+        for metrics in report.stages
+    }
+    for name, (wall, cpu) in passes.items():
+        result[f'optimize/{name}'] = {'wall': wall, 'cpu': cpu, 'items_in': None, 'items_out': None}
+
+    return result
+
+
+def run(sizes: list[int], operators: list[str], optimization_lvl: int | None, seed: int, repeat: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for rows in sizes:
+            path = os.path.join(temp_dir, f'DEF-9xx-{rows}.csv')
+            write_registry_csv(path, rows, seed)
+
+            # Из повторов берём лучшее время этапа - оно меньше всего зависит от шума машины
+            best: dict[str, dict] = {}
+            for attempt in range(repeat):
+                # Каждый повтор пишет в пустой каталог, иначе неизменённые конфиги не перезаписываются
+                output_dir = os.path.join(temp_dir, f'output-{rows}-{attempt}')
+                for name, stage in run_once(path, operators, optimization_lvl, output_dir).items():
+                    if name not in best or stage['wall'] < best[name]['wall']:
+                        best[name] = stage
+
+            results[str(rows)] = best
+            print_stages(rows, best)
+
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat,
+            'operators': operators,
+            'optimization_lvl': optimization_lvl,
+        },
+        'results': results,
+    }
+
+
+def print_stages(rows: int, stages: dict[str, dict]) -> None:
+    print(f'rows={rows}')
+    print(f'{"stage":<36} {"wall, s":>10} {"cpu, s":>10} {"in":>10} {"out":>10}')
+    for name, stage in stages.items():
+        items_in = '' if stage['items_in'] is None else stage['items_in']
+        items_out = '' if stage['items_out'] is None else stage['items_out']
+        print(f'{name:<36} {stage["wall"]:>10.3f} {stage["cpu"]:>10.3f} {items_in:>10} {items_out:>10}')
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_seconds: float) -> list[str]:
+    """
+    Этап считается регрессией, если он медленнее базового больше чем
+    на threshold (доля) и при этом больше чем на min_seconds - короткие
+    этапы иначе срабатывают от шума.
+    """
+    regressions = []
+    for rows, stages in current['results'].items():
+        for name, stage in stages.items():
+            base = baseline['results'].get(rows, {}).get(name)
+            if base is None:
+                continue
+
+            if stage['wall'] > base['wall'] * (1 + threshold) and stage['wall'] - base['wall'] > min_seconds:
+                regressions.append(f'rows={rows} {name}: {base["wall"]:.3f}s -> {stage["wall"]:.3f}s (+{(stage["wall"] / base["wall"] - 1) * 100:.0f}%)')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Per-stage timings on a synthetic registry with an optional regression check')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [10_000, 100_000])
+    parser.add_argument('--names', nargs = '+', default = get_operator_registry().names())
+    parser.add_argument('--lvl', type = int, default = None, help = 'optimizer cycles, default: until converged')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--repeat', type = int, default = 1, help = 'best of N runs for every stage')
+    parser.add_argument('--output', help = 'write results as JSON')
+    parser.add_argument('--baseline', help = 'JSON from a previous run to compare with')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed slowdown, 0.2 = 20%%')
+    parser.add_argument('--min-seconds', type = float, default = 0.05, help = 'ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    current = run(args.rows, args.names, args.lvl, args.seed, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(current, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline, encoding = 'utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(current, baseline, args.threshold, args.min_seconds)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+
+        if regressions:
+            sys.exit(1)
+
+        print(f'No regressions against {args.baseline}')
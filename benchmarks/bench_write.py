@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+
+from cfg import get_operator_registry
+from main import write_operator_config
+
+
+def legacy_write_operator_config(grouped_lines: dict[str, list[str]], output_dir: str) -> None:
+    # Прежняя запись: write на каждую строку прямо в итоговый файл
+    os.makedirs(output_dir, exist_ok = True)
+    for operator, patterns in grouped_lines.items():
+        with open(os.path.join(output_dir, f'{operator}_conf.cfg'), 'w', encoding = 'utf-8-sig') as f:
+            f.write(f"[{operator}_codes]\n")
+            for pattern in patterns:
+                if pattern.startswith('exten = '):
+                    f.write(f'{pattern}\n')
+
+                else:
+                    f.write(f'exten = {pattern},1,GoSub(${{ARG1}},${{EXTEN}},1)\n')
+
+            f.write("exten = _XXXX!,1,Return()\n")
+            f.write("exten = _XXXX!,2,Hangup()\n")
+
+
+def read_dir(path: str) -> dict[str, bytes]:
+    result = {}
+    for filename in os.listdir(path):
+        with open(os.path.join(path, filename), 'rb') as f:
+            result[filename] = f.read()
+
+    return result
+
+
+def run(lines_count: int) -> None:
+    operators = get_operator_registry().names()
+    grouped = {
+        operator: [f'_[78]9{i % 100:02d}{i % 10000000:07d}' for i in range(lines_count // len(operators))]
+        for operator in operators
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy_dir, current_dir = os.path.join(temp_dir, 'legacy'), os.path.join(temp_dir, 'current')
+
+        started = time.perf_counter()
+        legacy_write_operator_config(grouped, legacy_dir)
+        legacy_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        write_operator_config(grouped, current_dir)
+        current_time = time.perf_counter() - started
+
+        assert read_dir(legacy_dir) == read_dir(current_dir)
+
+    print(f'operators={len(operators)} lines={lines_count}')
+    print(f'write per line        {legacy_time:.3f}s')
+    print(f'join, atomic, threads {current_time:.3f}s ({legacy_time / current_time:.1f}x, includes fsync)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'write_operator_config: per-line writes versus one join with atomic replace')
+    parser.add_argument('--lines', type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    run(args.lines)
@@ -0,0 +1,110 @@
+import random
+
+from cfg import get_default_operators
+
+HEADER = 'ABC/ DEF;От;До;Емкость;Оператор;Регион;Территория ГАР;ИНН'
+
+
+def write_synthetic_csv(path: str, rows: int, seed: int = 0, aligned: bool = False) -> int:
+    """
+    aligned=True - диапазоны как в настоящем реестре: выровнены по блокам
+    10^3..10^6 и занимают несколько целых блоков, поэтому одни и те же пары
+    (от, до) повторяются в разных DEF-кодах.
+    """
+    # Пишем построчно, чтобы генерация большого файла не влияла на замер памяти
+    rnd = random.Random(seed)
+    inns = list(get_default_operators().values())
+    written = 0
+
+    with open(path, 'w', encoding = 'utf-8-sig', newline = '') as f:
+        f.write(HEADER + '\n')
+        for _ in range(rows):
+            def_code = rnd.randint(900, 999)
+            if aligned:
+                block = rnd.choices((1000, 10000, 100000, 1000000), weights = (2, 4, 3, 1))[0]
+                start = rnd.randrange(10 ** 7 // block) * block
+                end = start + block * rnd.choice((1, 1, 1, 2, 5)) - 1
+
+            else:
+                start = rnd.randint(0, 9989) * 1000
+                end = start + rnd.choice((999, 9999, 99999))
+
+            end = min(end, 9999999)
+            line = f'{def_code};{start:07d};{end:07d};{end - start + 1};ПАО "Оператор";Регион;Регион;{rnd.choice(inns)}\n'
+            written += f.write(line)
+
+    return written
+
+
+# Доли строк реестра по операторам, остальное - мелкие операторы и MVNO, которых отфильтровывает чтение
+OPERATOR_SHARES = {'mts': 24, 'megafon': 24, 'beeline': 18, 'tele2': 18, 'rostelecom': 3, 'yota': 3}
+OTHER_SHARE = 10
+OPERATOR_NAMES = {
+    'mts': 'ПАО "МТС"',
+    'megafon': 'ПАО "МЕГАФОН"',
+    'beeline': 'ПАО "ВЫМПЕЛКОМ"',
+    'tele2': 'ООО "Т2 МОБАЙЛ"',
+    'rostelecom': 'ПАО "РОСТЕЛЕКОМ"',
+    'yota': 'ООО "СКАРТЕЛ"',
+}
+REGIONS = ('г. Москва', 'г. Санкт-Петербург', 'Алтайский край', 'Краснодарский край', 'Республика Татарстан', 'Свердловская обл.')
+
+
+def write_registry_csv(path: str, rows: int, seed: int = 0) -> int:
+    """
+    Реестр, похожий на настоящий DEF-9xx.csv: строки идут по DEF-кодам
+    900-999 и по возрастанию номеров, у каждого кода есть основной оператор,
+    диапазоны выровнены по блокам и бывают от десятков номеров до миллионов.
+    Для одних и тех же rows и seed файл всегда одинаковый.
+    """
+    rnd = random.Random(seed)
+    operators = get_default_operators()
+    names = list(OPERATOR_SHARES)
+    others = [f'{rnd.randrange(10 ** 9, 10 ** 10)}' for _ in range(40)]
+    def_codes = range(900, 1000)
+    written = 0
+
+    with open(path, 'w', encoding = 'utf-8-sig', newline = '') as f:
+        f.write(HEADER + '\n')
+        for index, def_code in enumerate(def_codes):
+            count = rows // len(def_codes) + (index < rows % len(def_codes))
+            if count == 0:
+                continue
+
+            # Код делится на count..10*count одинаковых слотов, лишние слоты уходят на широкие диапазоны и дыры
+            slot = 10 ** max(0, 7 - len(str(count)))
+            free = 10 ** 7 // slot - count
+            owner = rnd.choices(names, weights = list(OPERATOR_SHARES.values()))[0]
+            position = 0
+
+            for _ in range(count):
+                gap = min(free, rnd.choice((0, 0, 0, 1)))
+                span = 1 + min(free - gap, rnd.choice((0, 0, 0, 1, 4, 9)))
+                free -= gap + span - 1
+                position += gap * slot
+
+                start, end = position, position + span * slot - 1
+                if span == 1 and slot >= 100 and rnd.random() < 0.3:
+                    # Кусок слота, выровненный по меньшему блоку
+                    block = slot // rnd.choice((10, 100))
+                    start += rnd.randrange(slot // block) * block
+                    end = min(start + block * rnd.choice((1, 2, 5)) - 1, end)
+
+                position += span * slot
+
+                if rnd.random() < 0.8:
+                    name = owner
+
+                elif rnd.random() < OTHER_SHARE / (OTHER_SHARE + 20):
+                    name = None
+
+                else:
+                    name = rnd.choices(names, weights = list(OPERATOR_SHARES.values()))[0]
+
+                inn = operators[name] if name else rnd.choice(others)
+                operator_name = OPERATOR_NAMES[name] if name else 'ООО "Оператор"'
+                region = rnd.choice(REGIONS)
+                line = f'{def_code};{start:07d};{end:07d};{end - start + 1};{operator_name};{region};{region};{inn}\n'
+                written += f.write(line)
+
+    return written
@@ -0,0 +1,167 @@
+import json
+import os
+from dataclasses import asdict
+
+from cfg import DownloadMeta, logger
+
+
+def meta_path(filename: str) -> str:
+    return f'{filename}.meta'
+
+
+def pending_meta_path(filename: str) -> str:
+    return f'{filename}.meta.pending'
+
+
+def partial_meta_path(filename: str) -> str:
+    return f'{filename}.part.meta'
+
+
+def snapshot_path(filename: str) -> str:
+    return f'{filename}.snapshot'
+
+
+def load_download_meta(filename: str, settings: dict | None = None) -> DownloadMeta | None:
+    """
+    Версия реестра последнего успешного прогона. Прогон с другими настройками
+    (операторы, стратегия) собирал другие конфиги, для него кэша нет.
+    """
+    return load_meta(meta_path(filename), settings)
+
+
+def load_partial_meta(filename: str) -> DownloadMeta | None:
+    # Валидаторы той версии файла, с которой начата недокачанная часть
+    return load_meta(partial_meta_path(filename))
+
+
+def save_partial_meta(filename: str, meta: DownloadMeta) -> None:
+    write_json_atomic(partial_meta_path(filename), asdict(meta))
+
+
+def load_meta(path: str, settings: dict | None = None) -> DownloadMeta | None:
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r', encoding = 'utf-8') as f:
+            data = json.load(f)
+
+        stored = data.pop('settings', None)
+        meta = DownloadMeta(**data)
+
+    except (ValueError, TypeError, AttributeError) as e:
+        # Битый кэш не повод падать, просто скачаем заново
+        logger.warning(f'Ignoring broken download cache {path}: {e}')
+        return None
+
+    if stored != settings:
+        logger.info(f'Download cache {path} was committed with {stored}, downloading again')
+        return None
+
+    return meta
+
+
+def save_pending_download_meta(filename: str, meta: DownloadMeta) -> None:
+    # Метаданные становятся действующими только после успешного прогона (commit_download_meta)
+    write_json_atomic(pending_meta_path(filename), asdict(meta))
+
+
+def commit_download_meta(filename: str, settings: dict | None = None) -> None:
+    # Вместе с версией запоминаем, с какими настройками по ней собраны конфиги
+    pending = pending_meta_path(filename)
+    if not os.path.exists(pending):
+        return
+
+    with open(pending, 'r', encoding = 'utf-8') as f:
+        data = json.load(f)
+
+    write_json_atomic(meta_path(filename), {**data, 'settings': settings})
+    os.remove(pending)
+
+
+def conditional_headers(meta: DownloadMeta) -> dict[str, str]:
+    headers = {}
+    if meta.etag:
+        headers['If-None-Match'] = meta.etag
+
+    if meta.last_modified:
+        headers['If-Modified-Since'] = meta.last_modified
+
+    return headers
+
+
+def load_snapshot(path: str, settings: dict) -> dict[tuple[str, int], dict]:
+    """
+    Снимок прошлого инкрементального запуска: для каждой части (оператор, DEF-код)
+    хэш её строк и готовые шаблоны. Снимок другого режима оптимизации не годится.
+    """
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, 'r', encoding = 'utf-8') as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('settings') != settings:
+            logger.info(f'Snapshot {path} was built with {snapshot.get("settings")}, regenerating everything')
+            return {}
+
+        return {partition_key(key): value for key, value in snapshot['partitions'].items()}
+
+    except (ValueError, KeyError, AttributeError) as e:
+        logger.warning(f'Ignoring broken snapshot {path}: {e}')
+        return {}
+
+
+def save_snapshot(path: str, settings: dict, partitions: dict[tuple[str, int], dict]) -> None:
+    # В json ключи только строки: 'оператор:DEF-код'
+    partitions = {f'{operator}:{def_code}': value for (operator, def_code), value in partitions.items()}
+    write_json_atomic(path, {'settings': settings, 'partitions': partitions})
+
+
+def partition_key(key: str) -> tuple[str, int]:
+    # DEF-код - число без ':', поэтому режем по последнему двоеточию, а в имени оператора оно может быть
+    operator, def_code = key.rsplit(':', 1)
+    return operator, int(def_code)
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(data, f, ensure_ascii = False)
+
+    os.replace(tmp_path, path)
+
+
+def write_file_atomic(path: str, data: bytes) -> None:
+    """
+    Пишет во временный файл рядом, сбрасывает его на диск и подменяет
+    path одним os.replace: читатель видит либо старый файл, либо новый целиком.
+    """
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise
+
+
+def fsync_dir(path: str) -> None:
+    # Переименование попадает на диск только с fsync каталога, на Windows так нельзя и не нужно
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+
+    finally:
+        os.close(fd)
@@ -1,7 +1,14 @@
+import json
 import logging
+import multiprocessing
 import os
-from dataclasses import dataclass
-from logging.handlers import RotatingFileHandler
+import sys
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, Iterator
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from dotenv import load_dotenv
 
@@ -17,6 +24,9 @@ class WarningError(BaseException):
 class SkipError(BaseException):
     ...
 
+class RetryableError(BaseException):
+    ...
+
 # Переменные для gitea
 GITEA_URL : str = os.getenv('GITEA_URL')
 OWNER : str = os.getenv('OWNER')
@@ -27,13 +37,44 @@ TOKEN : str = os.getenv('TOKEN')
 DOWNLOAD_URL : str = os.getenv('DOWNLOAD_URL')
 DEFAULT_FILENAME : str = os.getenv('DEFAULT_FILENAME')
 OUTPUT_DIR_NAME : str = os.getenv('OUTPUT_DIR_NAME')
+CACHE_DIR : str = os.getenv('CACHE_DIR', '.cache') # Кэш скачанного реестра между запусками
+OPERATORS_FILE : str = os.getenv('OPERATORS_FILE') # json с операторами сверх шести стандартных
+DOWNLOAD_CHUNK_SIZE : int = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 256 * 1024)) # Размер блока при потоковом скачивании
+DOWNLOAD_RETRIES : int = int(os.getenv('DOWNLOAD_RETRIES', 5)) # Сколько раз докачиваем после обрыва
+DOWNLOAD_BACKOFF : float = float(os.getenv('DOWNLOAD_BACKOFF', 1.0)) # Первая пауза перед повтором, дальше удваивается
+DOWNLOAD_BACKOFF_MAX : float = float(os.getenv('DOWNLOAD_BACKOFF_MAX', 30.0))
+STREAM_QUEUE_SIZE : int = int(os.getenv('STREAM_QUEUE_SIZE', 64)) # Сколько блоков сети держим впереди парсера
+RANGE_CACHE_SIZE : int = int(os.getenv('RANGE_CACHE_SIZE', 65536)) # Сколько разложений диапазонов помнить между строками
+OPTIMIZATION_MAX_CYCLES : int = int(os.getenv('OPTIMIZATION_MAX_CYCLES', 10)) # Предел циклов оптимизатора в режиме до сходимости
+WRITE_WORKERS : int = int(os.getenv('WRITE_WORKERS', 8)) # Сколько конфигов операторов пишем одновременно
+
+DOWNLOAD_HEADERS : dict[str, str] = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/csv,application/csv',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'identity', # Размер, Range и Digest считаются по байтам без сжатия
+    'Referer': 'https://opendata.digital.gov.ru/',
+}
+
+# Формат номеров в реестре: 3 цифры DEF-кода и 7 цифр номера
+DEF_CODE_WIDTH : int = 3
+NUMBER_WIDTH : int = 7
+
+# Способы построения шаблонов (см. main.optimize_parsed)
+STRATEGIES : tuple[str, ...] = ('passes', 'merged', 'trie')
 
 # Настройки Логгера
+LOG_LEVEL : str = os.getenv('LOG_LEVEL', 'INFO').upper() # DEBUG включает трассировку
+LOG_FILENAME : str = 'app.log'
+RUN_REPORT_FILENAME : str = os.path.join(os.path.dirname(LOG_FILENAME), 'run_report.json') # Замеры этапов последнего запуска
+PROFILE_DIR : str = os.path.join(os.path.dirname(LOG_FILENAME), 'profile') # Куда --profile пишет профили этапов
+PROFILE_INTERVAL : float = float(os.getenv('PROFILE_INTERVAL', 0.005)) # Шаг сэмплирующего профилировщика, секунды
+
 logger = logging.getLogger("App")
-logger.level = logging.INFO # Уровень логирования
+logger.setLevel(LOG_LEVEL)
 
 handler = RotatingFileHandler(
-    filename = 'app.log',
+    filename = LOG_FILENAME,
     maxBytes = 5 * 1024 * 1024,
     backupCount = 5,
     encoding = 'utf-8'
@@ -44,21 +85,128 @@ handler.setFormatter(formatter)
 
 logger.addHandler(handler)
 
-@dataclass
+
+def tracing() -> bool:
+    """
+    Включена ли трассировка (уровень DEBUG). Проверка кэшируется логгером,
+    поэтому ею стоит закрывать подготовку тяжёлых данных для лога.
+    """
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def trace(msg: str, *args) -> None:
+    # Ленивое форматирование: при выключенной трассировке аргументы не превращаются в строки
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args, stacklevel = 2)
+
+
+@contextmanager
+def worker_log_queue() -> Iterator[multiprocessing.Queue]:
+    # Записи дочерних процессов приходят через очередь, в app.log пишет только главный процесс
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level = True)
+    listener.start()
+    try:
+        yield log_queue
+
+    finally:
+        listener.stop()
+
+
+def init_worker_logging(log_queue: multiprocessing.Queue, level: int) -> None:
+    # initializer для ProcessPoolExecutor: вместо файла логгер App пишет в очередь
+    logger.handlers[:] = [QueueHandler(log_queue)]
+    logger.setLevel(level)
+
+@dataclass(slots = True)
 class RowData:
     def_code: int
     start_input: int
     end_input: int
     operator_name: str
-    inn: int
+    inn: str
 
-@dataclass
+    def __post_init__(self):
+        # Из csv приходят строки: числа храним числами, повторяющиеся названия - одним объектом
+        self.def_code = int(self.def_code)
+        self.start_input = int(self.start_input)
+        self.end_input = int(self.end_input)
+        self.operator_name = sys.intern(self.operator_name)
+        self.inn = sys.intern(self.inn)
+
+@dataclass(slots = True)
 class PatternLine:
     pattern: str
     operator_name: str
     inn: str
 
-@dataclass
+    def __post_init__(self):
+        self.operator_name = sys.intern(self.operator_name)
+        self.inn = sys.intern(self.inn)
+
+
+class PatternLines:
+    """
+    Колоночное хранилище PatternLine для всего реестра: DEF-код и номер
+    оператора лежат в array, хвосты шаблонов интернированы (одни и те же
+    XXXXXXX, 0XXXXXX встречаются во всех DEF-кодах). PatternLine
+    собирается только при обходе.
+    """
+    __slots__ = ('def_codes', 'bodies', 'operator_ids', 'operators', '_operator_index')
+
+    def __init__(self):
+        self.def_codes = array('H')
+        self.bodies: list[str] = []
+        self.operator_ids = array('H')
+        self.operators: list[tuple[str, str]] = [] # (operator_name, inn) по номеру
+        self._operator_index: dict[tuple[str, str], int] = {}
+
+    def operator_id(self, operator_name: str, inn: str) -> int:
+        key = (operator_name, inn)
+        operator_id = self._operator_index.get(key)
+        if operator_id is None:
+            operator_id = self._operator_index[key] = len(self.operators)
+            self.operators.append((sys.intern(operator_name), sys.intern(inn)))
+
+        return operator_id
+
+    def append(self, def_code: int, body: str, operator_id: int) -> None:
+        self.def_codes.append(def_code)
+        self.bodies.append(sys.intern(body))
+        self.operator_ids.append(operator_id)
+
+    def extend(self, other: 'PatternLines') -> None:
+        # Номера операторов у другого хранилища свои, переводим их в наши
+        mapping = [self.operator_id(name, inn) for name, inn in other.operators]
+        self.def_codes.extend(other.def_codes)
+        self.bodies.extend(sys.intern(body) for body in other.bodies)
+        self.operator_ids.extend(mapping[operator_id] for operator_id in other.operator_ids)
+
+    def __len__(self) -> int:
+        return len(self.bodies)
+
+    def __getitem__(self, index: int) -> PatternLine:
+        operator_name, inn = self.operators[self.operator_ids[index]]
+        return PatternLine(f'_[78]{self.def_codes[index]:03d}{self.bodies[index]}', operator_name, inn)
+
+    def __iter__(self) -> Iterator[PatternLine]:
+        for index in range(len(self.bodies)):
+            yield self[index]
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PatternLines):
+            return NotImplemented
+
+        return list(self) == list(other)
+
+    def __getstate__(self):
+        return self.def_codes, self.bodies, self.operator_ids, self.operators
+
+    def __setstate__(self, state):
+        self.def_codes, self.bodies, self.operator_ids, self.operators = state
+        self._operator_index = {key: i for i, key in enumerate(self.operators)}
+
+@dataclass(slots = True)
 class Pattern:
     prefix: str
     mask: list[str]
@@ -68,11 +216,22 @@ class Pattern:
         return f'exten = _[78]{pattern_str},1,GoSub(${{ARG1}},${{EXTEN}},1)'
 
 @dataclass
-class PatternItem:
-    original: str
-    digit_part: str
-    x_count: int
-    pattern_body: str
+class DownloadMeta:
+    etag: str | None
+    last_modified: str | None
+    sha256: str
+    size: int
+
+@dataclass(slots = True, frozen = True)
+class PatternIR:
+    """
+    Шаблон внутри оптимизатора: ведущие цифры и битовая маска цифр для
+    каждой следующей позиции (см. optimized.TOKENS). Строка разбирается один
+    раз на входе, original - исходная строка, если шаблон не менялся.
+    """
+    prefix: str
+    mask: tuple[int, ...]
+    original: str | None = field(default = None, compare = False)
 
 
 def get_default_operators() -> dict[str]:
@@ -87,10 +246,47 @@ def get_default_operators() -> dict[str]:
     return default_operators
 
 
-def get_operator_to_inn(inn: str) -> str:
+class OperatorRegistry:
+    """
+    Справочник операторов, собирается один раз: прямой (имя -> ИНН)
+    и обратный (ИНН -> имя) индексы готовы заранее.
+    """
+    def __init__(self, operators: dict[str, str]):
+        self.by_name: dict[str, str] = dict(operators)
+        self.by_inn: dict[str, str] = {inn: name for name, inn in self.by_name.items()}
+
+    def names(self) -> list[str]:
+        return list(self.by_name.keys())
+
+    def inn(self, name: str) -> str | None:
+        return self.by_name.get(name)
+
+    def name(self, inn: str) -> str | None:
+        return self.by_inn.get(inn)
+
+    def inns_for(self, names: Iterable[str]) -> frozenset[str]:
+        return frozenset(self.by_name[name] for name in names if name in self.by_name)
+
+
+@lru_cache(maxsize = None)
+def get_operator_registry() -> OperatorRegistry:
     operators = get_default_operators()
-    reverse_mapping = {inn: name for name, inn in operators.items()}
-    
-    operator_name = reverse_mapping.get(inn)
-    return operator_name
-    
\ No newline at end of file
+
+    # Дополнительные операторы из json файла вида {"name": "inn"}, совпадающие имена переопределяют дефолтные
+    if OPERATORS_FILE:
+        try:
+            with open(OPERATORS_FILE, 'r', encoding = 'utf-8') as f:
+                extra = json.load(f)
+
+        except (IOError, ValueError) as e:
+            logger.critical(f'Can`t load operators from {OPERATORS_FILE}: {e}')
+            raise CriticalError from e
+
+        operators.update({str(name): str(inn) for name, inn in extra.items()})
+        logger.info(f'Loaded {len(extra)} operators from {OPERATORS_FILE}')
+
+    return OperatorRegistry(operators)
+
+
+def get_operator_to_inn(inn: str) -> str:
+    return get_operator_registry().name(inn)
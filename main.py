@@ -1,254 +1,847 @@
 import argparse
 import base64
 import csv
+import hashlib
+import io
 import json
+import mmap
 import os
-import shutil
+import re
+import sys
+import time
+import zlib
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Generator
+from functools import lru_cache
+from itertools import repeat
+from typing import Any, Generator, Iterable, TextIO
 
 import requests
-from requests.exceptions import ConnectionError, Timeout
-
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from cache import (
+    commit_download_meta,
+    conditional_headers,
+    fsync_dir,
+    load_download_meta,
+    load_partial_meta,
+    load_snapshot,
+    partial_meta_path,
+    save_partial_meta,
+    save_pending_download_meta,
+    save_snapshot,
+    snapshot_path,
+    write_file_atomic,
+)
 from cfg import (
+    CACHE_DIR,
+    DEF_CODE_WIDTH,
     DEFAULT_FILENAME, 
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_BACKOFF_MAX,
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_HEADERS,
+    DOWNLOAD_RETRIES,
     DOWNLOAD_URL, 
     GITEA_URL, 
+    NUMBER_WIDTH,
     OUTPUT_DIR_NAME,
     OWNER, 
+    PROFILE_DIR,
+    RANGE_CACHE_SIZE,
     REPO, 
+    RUN_REPORT_FILENAME,
+    STRATEGIES,
     TOKEN, 
-    CriticalError, SkipError, WarningError,
-    PatternLine, RowData,
-    get_default_operators, get_operator_to_inn, 
-    logger
+    WRITE_WORKERS,
+    CriticalError, RetryableError, SkipError, WarningError,
+    DownloadMeta, PatternLine, PatternLines, RowData,
+    get_operator_registry, get_operator_to_inn, 
+    init_worker_logging,
+    logger,
+    trace,
+    tracing,
+    worker_log_queue
 )
+from metrics import StageMetrics, add_stages, collect_stages, finish_report, stage, start_report
 from optimized import optimize_patterns_in_memory
+from profiling import PROFILERS, profiling
+from ranges import decompose_range, minimal_patterns
+from streaming import open_registry_stream
+from trie import trie_patterns
+
+
+def main(
+        selected_operators: list[str], 
+        filename: str = DEFAULT_FILENAME, 
+        optimization_lvl: int | None = None, 
+        force: bool = False,
+        stream: bool = False,
+        workers: int = 1,
+        strategy: str = 'passes',
+        incremental: bool = False,
+        input_file: str | None = None,
+        output_dir: str | None = None,
+        upload: bool = True,
+        dry_run: bool = False):
+    """
+    input_file - готовый CSV реестра вместо скачивания ('-' - stdin),
+    output_dir - куда писать конфиги вместо OUTPUT_DIR_NAME,
+    upload=False - не выгружать в gitea, dry_run - только напечатать,
+    что было бы выгружено. С input_file и без выгрузки прогон не ходит в сеть.
+    """
+    output_dir = output_dir or OUTPUT_DIR_NAME
+    report = start_report({
+        'operators': selected_operators,
+        'input_file': input_file,
+        'output_dir': output_dir,
+        'upload': upload,
+        'dry_run': dry_run,
+        'optimization_lvl': optimization_lvl,
+        'stream': stream,
+        'workers': workers,
+        'strategy': strategy,
+        'incremental': incremental,
+    })
+    report.status = 'failed'
+    try:
+        os.makedirs(CACHE_DIR, exist_ok = True)
+        source_name = filename
+        if input_file:
+            source_name = 'stdin.csv' if input_file == '-' else os.path.basename(input_file)
+
+        cached_file = os.path.join(CACHE_DIR, source_name)
+        # Неизменённый реестр ничего не значит, если прошлый прогон собирал другие конфиги
+        run_settings = {'operators': sorted(selected_operators), 'strategy': strategy, 'optimization_lvl': optimization_lvl}
+        range_cache_start = range_cache_counts()
+        worker_range_cache = (0, 0) # Попадания и промахи кэша диапазонов в дочерних процессах
+
+        if input_file == '-':
+            # stdin читается один раз, поэтому как и в --stream разбираем строки по мере чтения
+            logger.info('Reading registry from stdin')
+            with stage('read+parse') as metrics:
+                rows = iter_csv_rows(open_stdin())
+                parsed = list(rows) if incremental else parse_rows(rows, selected_operators, strategy)
+                metrics.items_out = len(parsed)
+
+        elif stream and not input_file:
+            # Разбираем строки по мере скачивания, файл параллельно пишется в кэш
+            logger.info(f'Streaming file: {filename} from: {DOWNLOAD_URL}')
+            with stage('download+read+parse') as metrics:
+                registry = open_registry_stream(cached_file, DOWNLOAD_URL, use_cache = not force, settings = run_settings)
+                if registry is None:
+                    logger.info('Registry not changed since last run, nothing to do')
+                    report.status = 'unchanged'
+                    return
+
+                with registry:
+                    logger.info('Parsing lines from stream')
+                    rows = iter_csv_rows(registry.text())
+                    parsed = list(rows) if incremental else parse_rows(rows, selected_operators, strategy)
+                    metrics.items_out = len(parsed)
+
+                    if not registry.finish():
+                        logger.info('Registry not changed since last run, nothing to do')
+                        report.status = 'unchanged'
+                        return
 
+        else:
+            if input_file:
+                logger.info(f'Using local file: {input_file}')
+                file = input_file
 
-def main(selected_operators: list[str], filename: str = DEFAULT_FILENAME, optimization_lvl: int = 2):
-    try:
-        if os.path.exists(OUTPUT_DIR_NAME):
-            shutil.rmtree(OUTPUT_DIR_NAME)
+            else:
+                logger.info(f'Downloading file: {filename} from: {DOWNLOAD_URL}')
+                with stage('download') as metrics:
+                    file = download_file(filename = cached_file, use_cache = not force, settings = run_settings)
+                    if file is not None:
+                        metrics.items_out = os.path.getsize(file) # Байты
+
+            if file is None:
+                # Реестр не менялся с прошлого успешного прогона - генерировать нечего
+                logger.info('Registry not changed since last run, nothing to do')
+                report.status = 'unchanged'
+                return
+
+            if workers > 1 and strategy == 'passes' and not incremental:
+                logger.info(f'Reading and parsing file: {file}')
+                with stage('read+parse') as metrics:
+                    parsed, worker_range_cache = parse_file_parallel(file, selected_operators, workers)
+                    metrics.items_out = len(parsed)
 
-        logger.info(f'Downloading file: {filename} from: {DOWNLOAD_URL}')
-        file = download_file(filename = filename)
+            else:
+                logger.info(f'Reading file: {file}')
+                with stage('read') as metrics:
+                    # Строки читаем целиком, чтобы чтение и разбор замерялись отдельно
+                    raw_data = list(read_csv_file_fast(file, get_selected_inns(selected_operators)))
+                    metrics.items_out = len(raw_data)
 
-        logger.info(f'Reading file: {filename}')
-        raw_data = read_csv_file(file)
+                if incremental:
+                    parsed = raw_data
 
-        logger.info('Parsing lines from raw_data')
-        all_data = parsing_rows(raw_data, selected_operators)
-  
-        logger.info('Grouping all lines')
-        grouped_data = grouping_lines(all_data)
+                else:
+                    logger.info('Parsing lines from raw_data')
+                    with stage('parse', len(raw_data)) as metrics:
+                        parsed = parse_rows(raw_data, selected_operators, strategy)
+                        metrics.items_out = len(parsed)
+
+        if incremental:
+            # parsed здесь - сырые строки реестра, разбираются только изменившиеся части
+            optimized_grouped_data = optimize_incremental(
+                parsed, selected_operators, strategy, optimization_lvl, snapshot_path(cached_file), workers
+            )
 
-        logger.info('Optimizing lines')
-        optimized_grouped_data = {}
-        for operator, patterns in grouped_data.items():
-            optimized_patterns = optimize_patterns_in_memory(patterns, optimization_lvl)
-            optimized_grouped_data[operator] = optimized_patterns
+        else:
+            optimized_grouped_data = optimize_parsed(parsed, strategy, optimization_lvl, workers)
+
+        log_range_cache_stats(range_cache_start, worker_range_cache)
 
         logger.info('Editing and writing in files')
-        write_operator_config(optimized_grouped_data)
-
-        logger.info('Upload data into gitea')
-        current_time = datetime.now(timezone.utc).isoformat()
-        upload_multiple_files_to_gitea(
-            GITEA_URL,
-            TOKEN,
-            OWNER,
-            REPO,
-            dates = {"author": current_time, "committer": current_time},
-        )
+        with stage('write', len(optimized_grouped_data)) as metrics:
+            # Конфиги операторов не из этого прогона удаляем, остальные перезаписываются только при изменении
+            remove_stale_configs(output_dir, optimized_grouped_data)
+            changed = write_operator_config(optimized_grouped_data, output_dir)
+            metrics.items_out = len(changed)
+
+        logger.info(f'{len(changed)} of {len(optimized_grouped_data)} configs changed: {", ".join(changed) or "none"}')
+
+        if dry_run:
+            print_upload_plan(output_dir, GITEA_URL, OWNER, REPO)
+
+        elif upload:
+            logger.info('Upload data into gitea')
+            with stage('upload', len(optimized_grouped_data)):
+                current_time = datetime.now(timezone.utc).isoformat()
+                upload_multiple_files_to_gitea(
+                    GITEA_URL,
+                    TOKEN,
+                    OWNER,
+                    REPO,
+                    output_dir = output_dir,
+                    dates = {"author": current_time, "committer": current_time},
+                )
+
+        else:
+            logger.info(f'Upload skipped, configs are in {output_dir}')
+
+        if not input_file and upload and not dry_run:
+            # Запоминаем версию реестра только когда весь прогон прошёл успешно
+            commit_download_meta(cached_file, run_settings)
+
+        report.status = 'ok'
 
     except CriticalError:
         raise  # Прерываем выполнение если произошла критическая ошибка
 
     finally:
-        logger.info('Deleting file')
-        if os.path.exists(filename):
-            os.remove(filename)
-            pass
+        report.write(RUN_REPORT_FILENAME)
+        finish_report()
 
 
-def download_file(filename: str, url: str = DOWNLOAD_URL) -> str | None:
-    try:
-        headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/csv,application/csv',
-        'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
-        'Referer': 'https://opendata.digital.gov.ru/',
-        }
-        req = requests.get(url, stream = True, headers = headers, timeout = 30)
+
+def parse_rows(raw_data: Iterable[list[str]], selected_operators: list[str], strategy: str) -> PatternLines | dict[str, list[tuple[int, int]]]:
+    # passes раскладывает каждую строку на шаблоны, merged и trie копят только интервалы номеров
+    if strategy in ('merged', 'trie'):
+        return collect_intervals(raw_data, selected_operators)
+
+    return parsing_rows(raw_data, selected_operators)
+
+
+def optimize_parsed(
+        parsed: PatternLines | dict[str, list[tuple[int, int]]], 
+        strategy: str, 
+        optimization_lvl: int | None,
+        workers: int = 1) -> dict[str, list[str]]:
+    if strategy == 'passes':
+        logger.info('Grouping all lines')
+        with stage('group', len(parsed)) as metrics:
+            parsed = grouping_lines(parsed)
+            metrics.items_out = len(parsed)
+
+    return optimize_groups(parsed, strategy, optimization_lvl, workers)
+
+
+def optimize_groups(
+        grouped: dict[str, list[str]] | dict[str, list[tuple[int, int]]], 
+        strategy: str, 
+        optimization_lvl: int | None,
+        workers: int = 1) -> dict[str, list[str]]:
+    # Группы (операторы или их DEF-коды) независимы, поэтому при workers > 1 каждая оптимизируется в своём процессе
+    if workers > 1 and len(grouped) > 1:
+        optimized_grouped_data = optimize_operators_parallel(grouped, strategy, optimization_lvl, workers)
+
+    else:
+        optimized_grouped_data = {}
+        for key, data in grouped.items():
+            optimized_grouped_data[key], stages = optimize_group(key, data, strategy, optimization_lvl)
+            add_stages(stages)
+
+    for key, patterns in optimized_grouped_data.items():
+        logger.info(f'{key}: {len(grouped[key])} {"lines" if strategy == "passes" else "ranges"} -> {len(patterns)} patterns')
+
+    return optimized_grouped_data
+
+
+def optimize_incremental(
+        raw_data: Iterable[list[str]], 
+        selected_operators: list[str], 
+        strategy: str, 
+        optimization_lvl: int | None,
+        snapshot_file: str,
+        workers: int = 1) -> dict[str, list[str]]:
+    """
+    Строки реестра делятся на части по (оператор, DEF-код). Части, строки
+    которых совпали со снимком прошлого запуска, берут готовые шаблоны
+    из снимка, остальные разбираются и оптимизируются заново.
+    Шаблоны разных DEF-кодов при этом не объединяются между собой.
+    """
+    registry = get_operator_registry()
+    selected = set(selected_operators)
+    partitions: dict[tuple[str, int], list[list[str]]] = defaultdict(list)
+    for row in raw_data:
+        operator = registry.name(row[4])
+        if operator not in selected:
+            continue
+
+        try:
+            def_code = int(row[0])
+            if not 0 <= def_code < 10 ** DEF_CODE_WIDTH:
+                raise ValueError(f'Bad DEF code {row[0]}')
+
+        except ValueError:
+            logger.error(f'Error while processing data: {row}', exc_info = True)
+            continue
+
+        partitions[(operator, def_code)].append(row)
+
+    settings = {'strategy': strategy, 'optimization_lvl': optimization_lvl}
+    snapshot = load_snapshot(snapshot_file, settings)
+    hashes = {key: hash_rows(rows) for key, rows in partitions.items()}
+    changed = [key for key in partitions if snapshot.get(key, {}).get('hash') != hashes[key]]
+    logger.info(f'Incremental run: {len(changed)} of {len(partitions)} (operator, DEF code) partitions changed')
+
+    # Имена групп только для логов и отчёта, обратно их не разбираем
+    labels = {key: f'{key[0]}:{key[1]}' for key in changed}
+    work = {}
+    for key in changed:
+        operator = key[0]
+        parsed = parse_rows(partitions[key], [operator], strategy)
+        grouped = grouping_lines(parsed) if strategy == 'passes' else parsed
+        work[labels[key]] = grouped.get(operator, [])
+
+    optimized = optimize_groups(work, strategy, optimization_lvl, workers)
+
+    # Части невыбранных операторов остаются в снимке для следующих запусков
+    new_snapshot = {key: value for key, value in snapshot.items() if key[0] not in selected}
+    optimized_grouped_data: dict[str, list[str]] = {operator: [] for operator in selected_operators}
+    for key in sorted(partitions, key = lambda key: key[1]):
+        lines = optimized[labels[key]] if key in labels else snapshot[key]['lines']
+        new_snapshot[key] = {'hash': hashes[key], 'lines': lines}
+        optimized_grouped_data[key[0]].extend(lines)
+
+    save_snapshot(snapshot_file, settings, new_snapshot)
+    return {operator: lines for operator, lines in optimized_grouped_data.items() if lines}
+
+
+def hash_rows(rows: list[list[str]]) -> str:
+    # Для шаблонов важны только диапазоны и их порядок
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(f'{row[1]}-{row[2]};'.encode())
+
+    return digest.hexdigest()
+
+
+def optimize_operator(data: list[str] | list[tuple[int, int]], strategy: str, optimization_lvl: int | None) -> list[str]:
+    # Выполняется и в дочернем процессе, поэтому функция на уровне модуля
+    if strategy == 'passes':
+        return optimize_patterns_in_memory(data, optimization_lvl)
+
+    logger.info(f'Building patterns from number ranges ({strategy})')
+    build_patterns = trie_patterns if strategy == 'trie' else minimal_patterns
+    return [
+        f'exten = _[78]{pattern},1,GoSub(${{ARG1}},${{EXTEN}},1)' 
+        for pattern in build_patterns(data, DEF_CODE_WIDTH + NUMBER_WIDTH)
+    ]
+
+
+def optimize_group(
+        key: str, 
+        data: list[str] | list[tuple[int, int]], 
+        strategy: str, 
+        optimization_lvl: int | None) -> tuple[list[str], list[StageMetrics]]:
+    # Замеры собираются отдельно и возвращаются вместе с шаблонами, в том числе из дочернего процесса
+    with collect_stages() as stages:
+        with stage(f'optimize/{key}', len(data)) as metrics:
+            lines = optimize_operator(data, strategy, optimization_lvl)
+            metrics.items_out = len(lines)
+
+    return lines, stages
+
+
+def optimize_operators_parallel(
+        parsed: dict[str, list[str]] | dict[str, list[tuple[int, int]]], 
+        strategy: str, 
+        optimization_lvl: int | None, 
+        workers: int) -> dict[str, list[str]]:
+    logger.info(f'Optimizing {len(parsed)} operators on {workers} workers')
+
+    with worker_log_queue() as log_queue:
+        with ProcessPoolExecutor(
+                max_workers = min(workers, len(parsed)), 
+                initializer = init_worker_logging, 
+                initargs = (log_queue, logger.level)) as pool:
+            # Крупные операторы отправляем первыми, чтобы общее время было близко к самому долгому из них
+            futures = {
+                operator: pool.submit(optimize_group, operator, data, strategy, optimization_lvl)
+                for operator, data in sorted(parsed.items(), key = lambda item: len(item[1]), reverse = True)
+            }
+
+            # Порядок результата как во входном словаре, а не в порядке завершения
+            result = {}
+            for operator in parsed:
+                result[operator], stages = futures[operator].result()
+                add_stages(stages)
+
+            return result
+
+
+def download_file(
+        filename: str, 
+        url: str = DOWNLOAD_URL, 
+        use_cache: bool = True, 
+        retries: int = DOWNLOAD_RETRIES,
+        settings: dict | None = None) -> str | None:
+    """
+    Возвращает путь к скачанному файлу или None, если реестр не изменился
+    с последнего успешного прогона с теми же settings (ответ 304 или совпал
+    sha256 содержимого).
+
+    Оборванная закачка остаётся в <filename>.part и докачивается через Range,
+    в том числе при следующем запуске.
+    """
+    headers = dict(DOWNLOAD_HEADERS)
+
+    cached_meta = load_download_meta(filename, settings) if use_cache else None
+    if cached_meta and os.path.exists(filename) and os.path.getsize(filename) == cached_meta.size:
+        headers.update(conditional_headers(cached_meta))
+
+    else:
+        cached_meta = None # Без самого файла метаданные бесполезны
+
+    for attempt in range(retries + 1):
+        try:
+            new_meta = download_attempt(filename, url, headers)
+            break
+
+        # req.raw отдаёт ошибки urllib3 как есть, без обёртки requests
+        except (ConnectionError, Timeout, ChunkedEncodingError, ProtocolError, ReadTimeoutError, RetryableError) as e:
+            if attempt == retries:
+                logger.critical(f"Download failed after {retries + 1} attempts, partial file kept: {e}")
+                raise CriticalError from e
+
+            delay = min(DOWNLOAD_BACKOFF * 2 ** attempt, DOWNLOAD_BACKOFF_MAX)
+            logger.warning(f'Download interrupted ({type(e).__name__}: {e}), retry {attempt + 1}/{retries} in {delay:.1f}s')
+            time.sleep(delay)
+
+        except Exception as e:
+            logger.critical(f"Unknown Exception {e}", exc_info = True)
+            raise CriticalError from e
+
+    if new_meta is None:
+        logger.info(f'Registry not modified on server, using cached {filename}')
+        return None
+
+    save_pending_download_meta(filename, new_meta)
+    if cached_meta and cached_meta.sha256 == new_meta.sha256:
+        # Сервер не поддержал условный запрос, но содержимое то же самое
+        logger.info(f'Registry content unchanged (sha256 {new_meta.sha256})')
+        commit_download_meta(filename, settings)
+        return None
+
+    return filename
+
+
+def download_attempt(filename: str, url: str, headers: dict[str, str]) -> DownloadMeta | None:
+    part_filename = f'{filename}.part' # Пишем во временный файл, чтобы не оставить полуготовый csv
+    part_meta = load_partial_meta(filename)
+
+    offset = 0
+    request_headers = dict(headers)
+    if part_meta and os.path.exists(part_filename):
+        offset = os.path.getsize(part_filename)
+
+    if offset:
+        # Докачиваем, только если на сервере та же версия файла, иначе придёт 200 и полный файл
+        request_headers['Range'] = f'bytes={offset}-'
+        validator = part_meta.etag or part_meta.last_modified
+        if validator:
+            request_headers['If-Range'] = validator
+
+    started = time.perf_counter()
+    downloaded = 0
+
+    with requests.get(url, stream = True, headers = request_headers, timeout = 30) as req:
+        if req.status_code == 304:
+            return None
+
+        if req.status_code == 416:
+            discard_partial(filename)
+            raise RetryableError(f'Range {offset}- not satisfiable, restarting from zero')
+
         req.raise_for_status()
 
-        with open(filename, "wb") as file:
-            file.write(req.content)
+        etag = req.headers.get('ETag')
+        last_modified = req.headers.get('Last-Modified')
+        content_encoding = req.headers.get('Content-Encoding', 'identity').lower()
 
-        return filename
+        if req.status_code == 206:
+            range_start, total = parse_content_range(req.headers.get('Content-Range'))
+            if range_start != offset:
+                discard_partial(filename)
+                raise RetryableError(f'Server resumed from {range_start} instead of {offset}')
+
+            logger.info(f'Resuming download of {filename} from byte {offset}')
+            mode = 'ab'
+
+        else:
+            offset = 0
+            total = int(req.headers['Content-Length']) if 'Content-Length' in req.headers else None
+            mode = 'wb'
+            save_partial_meta(filename, DownloadMeta(etag, last_modified, '', total or 0))
+
+        digest = hash_file(part_filename) if mode == 'ab' else hashlib.sha256()
+
+        with open(part_filename, mode) as file:
+            # Сырые байты тела: Content-Length, смещения Range и Digest относятся к ним, а не к распакованным
+            for chunk in req.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content = False):
+                file.write(chunk)
+                digest.update(chunk)
+                downloaded += len(chunk)
+
+        expected_digest = parse_digest_header(req.headers.get('Digest'))
+
+    size = os.path.getsize(part_filename)
+    if total is not None and size != total:
+        if size > total:
+            discard_partial(filename)
+        raise RetryableError(f'Size mismatch: got {size} bytes, expected {total}')
+
+    if expected_digest and expected_digest != digest.digest():
+        discard_partial(filename)
+        raise RetryableError('Checksum mismatch, restarting from zero')
+
+    if content_encoding != 'identity':
+        # Сервер сжал тело несмотря на Accept-Encoding: identity - распаковываем уже целый файл
+        logger.info(f'Registry came with Content-Encoding: {content_encoding}, decompressing')
+        decompress_file(part_filename, filename, content_encoding)
+        os.remove(part_filename)
+        digest = hash_file(filename)
+        size = os.path.getsize(filename)
+
+    else:
+        os.replace(part_filename, filename) # Атомарно подменяем файл только после полного скачивания
+
+    discard_partial(filename)
+
+    elapsed = time.perf_counter() - started
+    speed = downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0.0
+    logger.info(f'Downloaded {downloaded} bytes in {elapsed:.2f}s ({speed:.2f} MiB/s), total size {size}')
+
+    return DownloadMeta(etag, last_modified, digest.hexdigest(), size)
 
-    except ConnectionError as e:
-        logger.critical(f"ConnectionError {e}")
-        raise CriticalError from e
 
-    except Timeout as e:
-        logger.critical(f"TimeoutError {e}")
+def decompress_file(source: str, target: str, content_encoding: str) -> None:
+    if content_encoding not in ('gzip', 'x-gzip', 'deflate'):
+        logger.critical(f'Unsupported Content-Encoding: {content_encoding}')
+        raise CriticalError
+
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) # Сам различает заголовки gzip и zlib
+    tmp_target = f'{target}.tmp'
+    with open(source, 'rb') as src, open(tmp_target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b''):
+            dst.write(decompressor.decompress(chunk))
+
+        dst.write(decompressor.flush())
+
+    os.replace(tmp_target, target)
+
+
+def parse_content_range(value: str | None) -> tuple[int, int | None]:
+    # Формат: "bytes 100-199/1000" или "bytes 100-199/*"
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', value or '')
+    if not match:
+        raise RetryableError(f'Bad Content-Range: {value}')
+
+    total = None if match.group(2) == '*' else int(match.group(2))
+    return int(match.group(1)), total
+
+
+def parse_digest_header(value: str | None) -> bytes | None:
+    # RFC 3230: "Digest: sha-256=<base64>", другие алгоритмы не проверяем
+    for item in (value or '').split(','):
+        algorithm, _, encoded = item.strip().partition('=')
+        if algorithm.lower() == 'sha-256' and encoded:
+            return base64.b64decode(encoded)
+
+    return None
+
+
+def hash_file(path: str) -> 'hashlib._Hash':
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest
+
+
+def discard_partial(filename: str) -> None:
+    for path in (f'{filename}.part', partial_meta_path(filename)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_csv_file(path: str, columns: list[int] = [0, 1, 2, 4, 7]) -> Generator[list[str], Any, None]:
+    try:
+        with open(path, "r", encoding = "utf-8-sig", newline = "") as file:
+            yield from iter_csv_rows(file, columns)
+
+    except IOError as e:
+        logger.critical(f'Can`t read file on path: {path}, check accessability', exc_info = True)
         raise CriticalError from e
 
-    except Exception as e:
-        logger.critical(f"Unknown Exception {e}", exc_info = True)
+
+def read_csv_file_fast(
+        path: str, 
+        selected_inns: Iterable[str], 
+        columns: list[int] = [0, 1, 2, 4, 7], 
+        inn_column: int = 7,
+        byte_range: tuple[int, int] | None = None) -> Generator[list[str], Any, None]:
+    """
+    Быстрый вариант read_csv_file: файл читается через mmap как байты, ИНН
+    сравнивается до декодирования, и в строки/поля разбираются только
+    строки выбранных операторов. Поля с переводом строки внутри кавычек
+    (в реестре их нет) этот путь не поддерживает.
+
+    byte_range ограничивает чтение куском файла, границы должны стоять
+    на началах строк (см. split_file).
+    """
+    inns = b'|'.join(re.escape(inn.encode('utf-8')) for inn in sorted(selected_inns))
+    if not inns:
+        return
+
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+                header_end = mm.find(b'\n') + 1
+                # ИНН ищем справа: слева стоят текстовые поля, где ; может оказаться в кавычках
+                from_right = mm[:header_end].count(b';') - inn_column
+                # Регулярка в C проходит по всему файлу и останавливается только на строках нужных ИНН
+                pattern = re.compile(rb';(?:' + inns + rb')(?:;[^;\r\n]*){%d}\r?$' % from_right, re.MULTILINE)
+
+                start, end = byte_range or (header_end, len(mm))
+                lines = (
+                    mm[mm.rfind(b'\n', 0, match.start()) + 1:match.end()].decode('utf-8')
+                    for match in pattern.finditer(mm, max(start, header_end), end)
+                )
+
+                # Один csv.reader на все совпавшие строки - кавычки в названиях операторов разбирает он
+                for row in csv.reader(lines, delimiter = ';'):
+                    yield list(row[i] for i in columns)
+
+    except (IOError, ValueError) as e:
+        logger.critical(f'Can`t read file on path: {path}, check accessability', exc_info = True)
         raise CriticalError from e
 
 
-def read_csv_file(path: str, columns: list[int] = [0, 1, 2, 4, 7]) -> Generator[list[str], Any, None]:
+def split_file(path: str, parts: int) -> list[tuple[int, int]]:
+    # Делим файл без заголовка на куски примерно равного размера по границам строк
     try:
-        with open(path, "r", encoding = "utf-8-sig") as file:
-            reader = csv.reader(file, delimiter=";")
-            next(reader)
+        with open(path, "rb") as file:
+            header_end = len(file.readline())
+            size = os.fstat(file.fileno()).st_size
 
-            for row in reader:
-                yield list(row[i] for i in columns)
+            bounds = [header_end]
+            step = (size - header_end) / parts
+            for i in range(1, parts):
+                file.seek(header_end + int(step * i))
+                file.readline() # Дочитываем строку, на которую попали
+                bounds.append(max(file.tell(), bounds[-1]))
 
     except IOError as e:
         logger.critical(f'Can`t read file on path: {path}, check accessability', exc_info = True)
         raise CriticalError from e
 
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def parse_chunk(path: str, byte_range: tuple[int, int], selected_operators: list[str]) -> tuple[PatternLines, tuple[int, int]]:
+    # Выполняется в дочернем процессе, поэтому функция должна быть на уровне модуля.
+    # Кэш диапазонов у процесса свой и живёт между кусками, возвращаем прирост его счётчиков за кусок
+    hits, misses = range_cache_counts()
+    raw_data = read_csv_file_fast(path, get_selected_inns(selected_operators), byte_range = byte_range)
+    lines = parsing_rows(raw_data, selected_operators)
+    after_hits, after_misses = range_cache_counts()
+
+    return lines, (after_hits - hits, after_misses - misses)
+
+
+def parse_file_parallel(path: str, selected_operators: list[str], workers: int) -> tuple[PatternLines, tuple[int, int]]:
+    """
+    Строки всех кусков и суммарные (попадания, промахи) кэша диапазонов
+    в дочерних процессах - в родительском кэш при этом не используется.
+    """
+    chunks = split_file(path, workers * 4) # Кусков больше чем процессов, чтобы выровнять нагрузку
+    logger.info(f'Parsing {path} in {len(chunks)} chunks on {workers} workers')
+
+    all_data = PatternLines()
+    hits = misses = 0
+    with worker_log_queue() as log_queue:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_worker_logging, initargs = (log_queue, logger.level)) as pool:
+            # map отдаёт результаты в порядке кусков, так что порядок строк как в однопроцессном режиме
+            for lines, (chunk_hits, chunk_misses) in pool.map(parse_chunk, repeat(path), chunks, repeat(list(selected_operators))):
+                all_data.extend(lines)
+                hits += chunk_hits
+                misses += chunk_misses
+
+    return all_data, (hits, misses)
+
+
+def open_stdin() -> TextIO:
+    # Реестр приходит с BOM и в utf-8 независимо от локали, переводы строк разбирает csv
+    return io.TextIOWrapper(sys.stdin.buffer, encoding = 'utf-8-sig', newline = '')
+
 
-def parsing_rows(raw_data: Generator[list[str], Any, None], selected_operators: list[str]) -> list[PatternLine]:
-    all_data = []
-    selected_inns = []
-    operators_names = default_operators.keys()
+def iter_csv_rows(file: TextIO, columns: list[int] = [0, 1, 2, 4, 7]) -> Generator[list[str], Any, None]:
+    # Общий разбор для файла на диске и для потока из сети
+    reader = csv.reader(file, delimiter=";")
+    next(reader, None)
 
-    for op_name in selected_operators:
+    for row in reader:
+        yield list(row[i] for i in columns)
 
-        if op_name in operators_names:
-            selected_inns.append(default_operators.get(op_name))
+
+def parsing_rows(raw_data: Generator[list[str], Any, None], selected_operators: list[str]) -> PatternLines:
+    all_data = PatternLines()
+    selected_inns = get_selected_inns(selected_operators)
 
     for row in raw_data:
         
         if row[4] not in selected_inns:
             continue
 
-        current_row = RowData(row[0], row[1], row[2], row[3], row[4])
-        
         try:
-            result = range_of_numbers(current_row)
-            for i in result:
-                all_data.append(i)
+            current_row = RowData(row[0], row[1], row[2], row[3], row[4])
+            if not 0 <= current_row.def_code < 10 ** DEF_CODE_WIDTH:
+                # DEF-код хранится в array('H') и подставляется в шаблон как :03d
+                raise ValueError(f'Bad DEF code {row[0]}')
 
-        except SkipError:  # Продолжаем т.к. ошибка произошла в одном конкретном случае
+            result = range_patterns(current_row)
+
+        except (SkipError, ValueError):  # Продолжаем т.к. ошибка произошла в одном конкретном случае
             logger.error(
-                f'Error while processing data: {current_row}',
+                f'Error while processing data: {row}',
                 exc_info = True,
             )
             continue
-    logger.debug(f"{all_data=}")
-    
+
+        operator_id = all_data.operator_id(current_row.operator_name, current_row.inn)
+        for pattern in result:
+            all_data.append(current_row.def_code, pattern, operator_id)
+    trace('Parsed %d pattern lines', len(all_data))
+
     return all_data
 
 
-def range_of_numbers(current_row: RowData) -> list[PatternLine]:
-    try:
-        start = current_row.start_input.zfill(7)
-        end = current_row.end_input.zfill(7)
-
-        # Единичный номер
-        if start == end:
-            return [PatternLine(f'_[78]{current_row.def_code}{start}', current_row.operator_name, current_row.inn)]
-
-        # Находим общую часть
-        same_numbers = []
-        for i in range(7):
-            if start[i] == end[i]:
-                same_numbers.append(start[i])
-            else:
-                break
-        
-        numbers = ''.join(same_numbers)
-        n = len(numbers)
-        start_remaining = start[n:]
-        end_remaining = end[n:]
-        
-        stack = [(numbers, start_remaining, end_remaining)]
-        patterns = []
+def collect_intervals(raw_data: Iterable[list[str]], selected_operators: list[str]) -> dict[str, list[tuple[int, int]]]:
+    # Интервалы номеров по операторам: DEF-код становится старшими разрядами номера
+    operators = get_operator_registry()
+    selected_inns = operators.inns_for(selected_operators)
+    intervals: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    base = 10 ** NUMBER_WIDTH
 
-        while stack:
-            current_common, s_rest, e_rest = stack.pop(0)
+    for row in raw_data:
+        if row[4] not in selected_inns:
+            continue
 
-            # Если остатки пусты
-            if not s_rest and not e_rest:
-                patterns.append(current_common)
-                continue
+        try:
+            def_code, start, end = int(row[0]), int(row[1]), int(row[2])
+            if not (0 <= start <= end < base and 0 <= def_code < 10 ** DEF_CODE_WIDTH):
+                raise ValueError(f'Bad range {row[0]} {row[1]}-{row[2]}')
 
-            if not s_rest:
-                patterns.append(current_common + e_rest)
-                continue
+        except ValueError:
+            logger.error(f'Error while processing data: {row}', exc_info = True)
+            continue
 
-            if not e_rest:
-                patterns.append(current_common + s_rest)
-                continue
+        intervals[operators.name(row[4])].append((def_code * base + start, def_code * base + end))
 
-            # Проверка возможности замены на X
-            if (s_rest[1:] == '0' * len(s_rest[1:]) and 
-                e_rest[1:] == '9' * len(e_rest[1:])):
-                
-                start_current = s_rest[0]
-                end_current = e_rest[0]
+    return dict(intervals)
 
-                if start_current == end_current:
-                    pattern = current_common + start_current + 'X' * len(s_rest[1:])
-                else:
-                    pattern = (current_common + f'[{start_current}-{end_current}]' + 'X' * len(s_rest[1:]))
-                patterns.append(pattern)
 
-            else:
-                start_current = int(s_rest[0])
-                end_current = int(e_rest[0])
-
-                # Левая часть
-                if start_current != 9:
-                    new_s_rest = s_rest[1:]
-                    new_e_rest = '9' * len(s_rest[1:])
-                    stack.append((current_common + str(start_current), new_s_rest, new_e_rest))
-
-                # Средние части
-                for d in range(start_current + 1, end_current):
-                    new_s_rest = '0' * len(s_rest[1:])
-                    new_e_rest = '9' * len(s_rest[1:])
-                    stack.append((current_common + str(d), new_s_rest, new_e_rest))
-
-                # Правая часть
-                if end_current != 0:
-                    new_s_rest = '0' * len(s_rest[1:])
-                    new_e_rest = e_rest[1:]
-                    stack.append((current_common + str(end_current), new_s_rest, new_e_rest))
-
-        if not patterns:
-            patterns = [start]
-
-        # Преобразуем все patterns
-        results = []
-        for pattern in patterns:
-            pattern = pattern.replace('[0-9]', 'X')
-            results.append(PatternLine(f"_[78]{current_row.def_code}{pattern}", 
-                                     current_row.operator_name, current_row.inn))
-
-        return results
+def get_selected_inns(selected_operators: Iterable[str]) -> frozenset[str]:
+    return get_operator_registry().inns_for(selected_operators)
+
+
+def range_of_numbers(current_row: RowData) -> list[PatternLine]:
+    return [
+        PatternLine(f"_[78]{current_row.def_code:03d}{pattern}", current_row.operator_name, current_row.inn)
+        for pattern in range_patterns(current_row)
+    ]
+
+
+def range_patterns(current_row: RowData) -> tuple[str, ...]:
+    # Шаблоны диапазона без DEF-кода: '7704XXX', '77[0-3]XXXX'
+    try:
+        width = max(NUMBER_WIDTH, len(str(current_row.end_input))) # Номера в реестре 7-значные, дополняем нулями слева
+        return cached_decompose_range(current_row.start_input, current_row.end_input, width)
 
     except Exception as e:
         logger.error(f'Error processing range {current_row.start_input}-{current_row.end_input}: {e}')
         raise SkipError from e
 
 
-def grouping_lines(all_lines: list[PatternLine]) -> dict[str: list[str]]:
+@lru_cache(maxsize = RANGE_CACHE_SIZE)
+def cached_decompose_range(start: int, end: int, width: int) -> tuple[str, ...]:
+    # (start, end, width) - то же, что пара дополненных нулями строк: блоки вроде 0000000-0999999
+    # повторяются во всех DEF-кодах и у всех операторов, DEF-код к шаблонам добавляется уже снаружи
+    return tuple(decompose_range(start, end, width))
+
+
+def range_cache_counts() -> tuple[int, int]:
+    info = cached_decompose_range.cache_info()
+    return info.hits, info.misses
+
+
+def log_range_cache_stats(start: tuple[int, int], workers: tuple[int, int] = (0, 0)) -> None:
+    # Счётчики lru_cache накапливаются за всю жизнь процесса, поэтому считаем только прирост с start
+    hits, misses = range_cache_counts()
+    hits += workers[0] - start[0]
+    misses += workers[1] - start[1]
+    calls = hits + misses
+    if not calls:
+        return # merged и trie раскладывают интервалы без этого кэша
+
+    logger.info(f'Range cache: {hits} hits, {misses} misses ({hits / calls * 100:.1f}%)')
+
+
+def grouping_lines(all_lines: Iterable[PatternLine]) -> dict[str: list[str]]:
     grouped = defaultdict(list)
+    operator_keys: dict[str, str | None] = {} # ИНН в реестре мало, ищем каждый один раз
     for line in all_lines: 
-        operator_key: str = get_operator_to_inn(line.inn)
+        if line.inn not in operator_keys:
+            operator_keys[line.inn] = get_operator_to_inn(line.inn)
+
+        operator_key = operator_keys[line.inn]
 
         if not operator_key:
-            logger.debug(f'Не найден ключ для оператора: {line.operator_name}')
+            trace('Не найден ключ для оператора: %s', line.operator_name)
             continue
         
         grouped[operator_key].append(f'exten = {line.pattern},1,GoSub')
@@ -256,26 +849,108 @@ def grouping_lines(all_lines: list[PatternLine]) -> dict[str: list[str]]:
     return dict(grouped)
 
 
-def write_operator_config(grouped_lines: dict[str: list[str]]) -> None:
-    os.makedirs(OUTPUT_DIR_NAME, exist_ok = True)
+def write_operator_config(grouped_lines: dict[str: list[str]], output_dir: str | None = None) -> list[str]:
+    """
+    Конфиги пишутся атомарно (см. cache.write_file_atomic): reload диалплана
+    сразу после генерации не увидит наполовину записанный файл.
+    Операторы независимы, поэтому пишутся в нескольких потоках.
+    Файл, содержимое которого не изменилось, не трогается.
+    Возвращает операторов, чьи конфиги перезаписаны.
+    """
+    output_dir = output_dir or OUTPUT_DIR_NAME
+    os.makedirs(output_dir, exist_ok = True)
 
-    for operator, patterns in grouped_lines.items():
-        filepath = os.path.join(OUTPUT_DIR_NAME, f'{operator}_conf.cfg')
-        write_header = not os.path.exists(filepath)
+    with ThreadPoolExecutor(max_workers = max(1, min(WRITE_WORKERS, len(grouped_lines)))) as pool:
+        futures = {
+            operator: pool.submit(write_config_file, output_dir, operator, patterns) 
+            for operator, patterns in grouped_lines.items()
+        }
+        # result() пробрасывает ошибку записи любого из файлов
+        changed = [operator for operator, future in futures.items() if future.result()]
 
-        with open(filepath, 'w', encoding = 'utf-8-sig') as f:
-            if write_header:
-                f.write(f"[{operator}_codes]\n")
+    if changed:
+        fsync_dir(output_dir)
 
-            for pattern in patterns:
-                if pattern.startswith('exten = '):
-                    f.write(f'{pattern}\n')
+    return changed
+
+
+def write_config_file(output_dir: str, operator: str, patterns: list[str]) -> bool:
+    filepath = os.path.join(output_dir, f'{operator}_conf.cfg')
+    data = render_operator_config(operator, patterns).encode('utf-8-sig')
+    if file_blob_sha(filepath) == git_blob_sha(data):
+        return False
+
+    write_file_atomic(filepath, data)
+    return True
 
-                else:
-                    f.write(f'exten = {pattern},1,GoSub(${{ARG1}},${{EXTEN}},1)\n')
 
-            f.write("exten = _XXXX!,1,Return()\n")
-            f.write("exten = _XXXX!,2,Hangup()\n")
+def remove_stale_configs(output_dir: str, grouped_lines: dict[str: list[str]]) -> None:
+    # Раньше каталог целиком удалялся перед записью, теперь убираем только конфиги операторов не из этого прогона
+    if not os.path.isdir(output_dir):
+        return
+
+    for filename in config_files(output_dir):
+        if filename.removesuffix('_conf.cfg') not in grouped_lines:
+            logger.info(f'Removing stale config: {filename}')
+            os.remove(os.path.join(output_dir, filename))
+
+
+def git_blob_sha(data: bytes) -> str:
+    # sha, который git и gitea показывают для файла: sha1 от заголовка 'blob <размер>\0' и содержимого
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def file_blob_sha(path: str) -> str | None:
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        return git_blob_sha(f.read())
+
+
+def render_operator_config(operator: str, patterns: list[str]) -> str:
+    # Весь файл одной строкой: один join вместо write на каждый шаблон
+    lines = [f"[{operator}_codes]"]
+    lines.extend(
+        pattern if pattern.startswith('exten = ') else f'exten = {pattern},1,GoSub(${{ARG1}},${{EXTEN}},1)'
+        for pattern in patterns
+    )
+    lines.append("exten = _XXXX!,1,Return()")
+    lines.append("exten = _XXXX!,2,Hangup()")
+    return '\n'.join(lines) + '\n'
+
+
+def config_files(output_dir: str) -> list[str]:
+    # Конфиги операторов, которые уходят в gitea
+    return sorted(filename for filename in os.listdir(output_dir) if filename.endswith("_conf.cfg"))
+
+
+def print_upload_plan(output_dir: str, gitea_url: str | None, owner: str | None, repo: str | None, branch: str = "main") -> None:
+    # --dry-run: что ушло бы в gitea, без единого запроса к ней
+    print(f"Dry run, would upload to {gitea_url}/{owner}/{repo} ({branch}):")
+    for filename in config_files(output_dir):
+        file_path = os.path.join(output_dir, filename)
+        with open(file_path, "rb") as f:
+            lines = sum(1 for _ in f)
+
+        print(f"  {filename}: {os.path.getsize(file_path)} bytes, {lines} lines, blob {file_blob_sha(file_path)}")
+
+    logger.info(f"Dry run, upload of {output_dir} skipped")
+
+
+def remote_file_shas(api_url: str, headers: dict[str, str], branch: str) -> dict[str, str]:
+    # Один запрос на список файлов в корне репозитория вместо GET на каждый файл
+    response = requests.get(api_url, headers = headers, params = {"ref": branch})
+
+    if response.status_code == 404:
+        logger.info(f"Branch {branch} or repository is empty, all files will be created")
+        return {}
+
+    if response.status_code != 200:
+        logger.critical(f"Error listing files in Gitea: {response.status_code}: {response.text}")
+        raise CriticalError
+
+    return {item["path"]: item["sha"] for item in response.json() if item.get("type") == "file"}
 
 
 def upload_multiple_files_to_gitea(
@@ -284,6 +959,7 @@ def upload_multiple_files_to_gitea(
         owner: str, 
         repo: str, 
         branch: str = "main", 
+        output_dir: str | None = None,
         **optional_params) -> None:
     """
     **optional_params: Дополнительные параметры для API:
@@ -300,51 +976,47 @@ def upload_multiple_files_to_gitea(
 
     api_url = f"{gitea_url}/api/v1/repos/{owner}/{repo}/contents"
 
+    output_dir = output_dir or OUTPUT_DIR_NAME
+
     try:
         files_data = []
+        filenames = config_files(output_dir)
+        if not filenames:
+            logger.warning("No files to upload")
+            raise WarningError
 
-        for filename in os.listdir(OUTPUT_DIR_NAME):
-
-            if not filename.endswith("_codes.conf"): 
-                continue
+        remote_shas = remote_file_shas(api_url, headers, branch)
 
-            file_path = os.path.join(OUTPUT_DIR_NAME, filename)
-            with open(file_path, "r", encoding="utf-8") as f:
+        for filename in filenames:
+            with open(os.path.join(output_dir, filename), "rb") as f:
                 content = f.read()
-            encoded_content = base64.b64encode(content.encode("utf-8")).decode("utf-8")
 
-            file_check_url = f"{api_url}/{filename}"
-            check_response = requests.get(file_check_url, headers = headers, params = {"ref": branch})
+            # Gitea хранит sha блоба, поэтому неизменённый файл видно без скачивания его содержимого
+            remote_sha = remote_shas.get(filename)
+            if remote_sha == git_blob_sha(content):
+                logger.info(f"Unchanged, skipping: {filename}")
+                continue
 
             file_info = {
                 "path": filename,
-                "content": encoded_content,
+                "content": base64.b64encode(content).decode("utf-8"),
                 "branch": branch,
             }
 
-            if check_response.status_code == 200:
-                existing_file = check_response.json()
-                file_info["sha"] = existing_file["sha"]
+            if remote_sha:
+                file_info["sha"] = remote_sha
                 file_info["operation"] = "update"
                 logger.info(f"Will update existing file: {filename}")
 
-            elif check_response.status_code == 404:
+            else:
                 file_info["operation"] = "create"
                 logger.info(f"Will create new file: {filename}")
 
-            elif check_response.status_code == 502:
-                logger.critical(f"Error with Gitea servers: {check_response.status_code}: {check_response.text}")
-                break
-
-            else:
-                logger.error(f"Error checking file {filename}: {check_response.status_code}")
-                continue
-
             files_data.append(file_info)
 
         if not files_data:
-            logger.warning("No files to upload")
-            raise WarningError
+            logger.info("All configs match the repository, nothing to upload")
+            return
 
         data = {
             "files": files_data,
@@ -356,15 +1028,18 @@ def upload_multiple_files_to_gitea(
         optional_copy.pop("message", None)
         data.update(optional_copy)
 
-        logger.debug(f"Request data: {json.dumps(data, indent=2)}")
+        if tracing():
+            # Тело запроса с base64 всех файлов - сериализуем только когда его правда запишут
+            logger.debug('Request data: %s', json.dumps(data, indent = 2))
 
         response = requests.post(api_url, headers=headers, json=data)
 
-        if response.ok:
-            logger.info(f"Successfully processed {len(files_data)} files")
+        if not response.ok:
+            # Прогон не должен считаться успешным, иначе версия реестра запомнится и выгрузка не повторится
+            logger.critical(f"Failed to upload files: {response.status_code} - {response.text}")
+            raise CriticalError
 
-        else:
-            logger.error(f"Failed to upload files: {response.status_code} - {response.text}")
+        logger.info(f"Successfully processed {len(files_data)} files")
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Request error while upload with Gitea API: {e}")
@@ -389,7 +1064,7 @@ def upload_multiple_files_to_gitea(
 
 if __name__ == "__main__":
     try:
-        default_operators = get_default_operators()
+        operators = get_operator_registry()
         parser = argparse.ArgumentParser(
             description="Generate phone number ranges for specific operators"
         )
@@ -398,29 +1073,101 @@ if __name__ == "__main__":
             nargs = "+",
             help = "list of operators to Parse (--names mts megafon beeline)",
         )
+        parser.add_argument(
+            "--stream",
+            action = "store_true",
+            help = "parse the registry while it is downloading instead of after",
+        )
+        parser.add_argument(
+            "--workers",
+            type = int,
+            default = 1,
+            help = "parse the downloaded registry and optimize operators in N processes (parsing stays single-process with --stream)",
+        )
+        parser.add_argument(
+            "--strategy",
+            choices = STRATEGIES,
+            default = "passes",
+            help = "passes: per-row patterns + optimizer passes, merged: minimal cover of merged ranges, "
+                   "trie: one-pass digit trie of all ranges",
+        )
+        parser.add_argument(
+            "--incremental",
+            action = "store_true",
+            help = "re-optimize only (operator, DEF code) parts whose rows changed since the last run",
+        )
+        parser.add_argument(
+            "--input",
+            metavar = "PATH",
+            help = "use a local registry CSV instead of downloading it, '-' reads it from stdin",
+        )
+        parser.add_argument(
+            "--output-dir",
+            metavar = "DIR",
+            help = f"write configs into DIR instead of OUTPUT_DIR_NAME ({OUTPUT_DIR_NAME})",
+        )
+        parser.add_argument(
+            "--no-upload",
+            action = "store_true",
+            help = "only write configs, do not upload them into gitea",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action = "store_true",
+            help = "write configs and print what would be uploaded into gitea without sending anything",
+        )
+        parser.add_argument(
+            "--profile",
+            nargs = "?",
+            const = "cprofile",
+            choices = PROFILERS,
+            help = f"cprofile: a .prof file per stage, sample: collapsed stacks for a flamegraph; written to {PROFILE_DIR}",
+        )
+        parser.add_argument(
+            "--force",
+            action = "store_true",
+            help = "ignore download cache and regenerate even if the registry did not change",
+        )
         args = parser.parse_args()
 
         if args.names:  # Вызов с флагом --names
             selected_operators = []
 
             for name in args.names:
-                if name in default_operators.keys():
+                if operators.inn(name):
                     selected_operators.append(name)
 
                 else:
-                    print(f"Warning: Operator {name} not found in default_operators")
+                    print(f"Warning: Operator {name} not found in operators")
 
             print(f"Generating for: {selected_operators}")
 
         else:  # Дефолтный вызов
-            selected_operators: list[str] = default_operators.keys()
-            print(f"Generating for default operators: {', '.join(default_operators.keys())}")
+            selected_operators: list[str] = operators.names()
+            print(f"Generating for default operators: {', '.join(selected_operators)}")
 
-        if not GITEA_URL or not OWNER or not TOKEN or not REPO:
+        if not args.output_dir and not OUTPUT_DIR_NAME:
+            logger.warning('Output directory is not set: pass --output-dir or OUTPUT_DIR_NAME in .env')
+            raise WarningError
+
+        upload = not args.no_upload and not args.dry_run
+        if upload and (not GITEA_URL or not OWNER or not TOKEN or not REPO):
             logger.warning(f'Maybe you don`t write .env file {GITEA_URL=} {OWNER=} {TOKEN=} {REPO=}')
             raise WarningError
 
-        main(selected_operators = selected_operators)
+        with profiling(args.profile):
+            main(
+                selected_operators = selected_operators, 
+                force = args.force, 
+                stream = args.stream, 
+                workers = args.workers,
+                strategy = args.strategy,
+                incremental = args.incremental,
+                input_file = args.input,
+                output_dir = args.output_dir,
+                upload = upload,
+                dry_run = args.dry_run,
+            )
         print("________DONE________")
 
     except KeyboardInterrupt:
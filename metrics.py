@@ -0,0 +1,147 @@
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Iterator
+
+from cache import write_json_atomic
+from cfg import logger
+
+try:
+    import resource # Только unix, на Windows пиковую память не меряем
+except ImportError:
+    resource = None
+
+
+@dataclass(slots = True)
+class StageMetrics:
+    name: str
+    wall: float = 0.0 # Секунды по часам
+    cpu: float = 0.0 # Секунды процессора текущего процесса
+    peak_rss_delta_kb: int | None = None # На сколько за этап вырос пик памяти процесса
+    items_in: int | None = None
+    items_out: int | None = None
+
+
+class RunReport:
+    """
+    Замеры этапов одного запуска. Вложенные этапы получают имя
+    через '/', например optimize/mts/cycle0/compress_sequential.
+    """
+    def __init__(self, settings: dict | None = None):
+        self.settings = settings or {}
+        self.started = datetime.now(timezone.utc)
+        self.status = 'running'
+        self.stages: list[StageMetrics] = []
+        self._names: list[str] = []
+
+    @contextmanager
+    def stage(self, name: str, items_in: int | None = None) -> Iterator[StageMetrics]:
+        self._names.append(name)
+        metrics = StageMetrics('/'.join(self._names), items_in = items_in)
+        wall, cpu, rss = time.perf_counter(), time.process_time(), peak_rss_kb()
+        try:
+            with _stage_profiler(metrics.name) if _stage_profiler else nullcontext():
+                yield metrics
+
+        finally:
+            self._names.pop()
+            metrics.wall = time.perf_counter() - wall
+            metrics.cpu = time.process_time() - cpu
+            if rss is not None:
+                metrics.peak_rss_delta_kb = peak_rss_kb() - rss
+
+            self.stages.append(metrics)
+            logger.info(
+                'Stage %s: %.3fs wall, %.3fs cpu, +%s KiB peak RSS, %s -> %s items',
+                metrics.name, metrics.wall, metrics.cpu, metrics.peak_rss_delta_kb, metrics.items_in, metrics.items_out,
+                stacklevel = 3, # В логе место вызова stage(), а не contextmanager
+            )
+
+    @property
+    def current(self) -> str:
+        # Полное имя этапа, который выполняется сейчас
+        return '/'.join(self._names)
+
+    def extend(self, stages: list[StageMetrics]) -> None:
+        # Этапы из дочерних процессов, их имена уже полные
+        prefix = '/'.join(self._names)
+        for metrics in stages:
+            if prefix:
+                metrics.name = f'{prefix}/{metrics.name}'
+
+            self.stages.append(metrics)
+
+    def to_dict(self) -> dict:
+        return {
+            'started': self.started.isoformat(),
+            'finished': datetime.now(timezone.utc).isoformat(),
+            'status': self.status,
+            'settings': self.settings,
+            'peak_rss_kb': peak_rss_kb(),
+            'stages': [asdict(metrics) for metrics in self.stages],
+        }
+
+    def write(self, path: str) -> None:
+        write_json_atomic(path, self.to_dict())
+        logger.info(f'Run report written to {path}')
+
+
+_report: RunReport | None = None # Пока отчёт не начат, этапы не записываются
+_stage_profiler: Callable[[str], AbstractContextManager] | None = None
+
+
+def get_report() -> RunReport | None:
+    return _report
+
+
+def start_report(settings: dict) -> RunReport:
+    global _report
+    _report = RunReport(settings)
+    return _report
+
+
+def finish_report() -> None:
+    # Дальше этапы снова никуда не пишутся, отчёт не копится между запусками в одном процессе
+    global _report
+    _report = None
+
+
+def stage(name: str, items_in: int | None = None) -> AbstractContextManager[StageMetrics]:
+    # Этап текущего отчёта: with stage('parse', len(rows)) as metrics: ...
+    if _report is None:
+        # Без начатого отчёта этап только замеряется и пишется в лог, как проходы оптимизатора в тестах и бенчмарках
+        return RunReport().stage(name, items_in)
+
+    return _report.stage(name, items_in)
+
+
+def add_stages(stages: list[StageMetrics]) -> None:
+    # Этапы из collect_stages в текущий отчёт, если он есть
+    if _report is not None:
+        _report.extend(stages)
+
+
+def set_stage_profiler(profiler: Callable[[str], AbstractContextManager] | None) -> None:
+    # profiler(имя этапа) оборачивает каждый этап, см. profiling.StageProfiler
+    global _stage_profiler
+    _stage_profiler = profiler
+
+
+@contextmanager
+def collect_stages() -> Iterator[list[StageMetrics]]:
+    # Отдельный отчёт на время задачи: так этапы из дочернего процесса можно вернуть вместе с результатом
+    global _report
+    previous, _report = _report, RunReport()
+    try:
+        yield _report.stages
+
+    finally:
+        _report = previous
+
+
+def peak_rss_kb() -> int | None:
+    if resource is None:
+        return None
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # На Linux в килобайтах
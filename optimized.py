@@ -1,119 +1,152 @@
 import re
 from collections import defaultdict
 
-from cfg import Pattern, PatternItem, logger
+from cfg import OPTIMIZATION_MAX_CYCLES, Pattern, PatternIR, logger, trace
+from metrics import stage
 
 
-def optimize_patterns_in_memory(patterns: list[str], optimization_lvl: int) -> list[str]:
+def digit_range(low: int, high: int) -> int:
+    return (1 << high + 1) - (1 << low)
+
+
+def is_contiguous(digits: int) -> bool:
+    # Сдвигаем младшую единицу в нулевой бит, сплошной диапазон превращается в 2^n - 1
+    run = digits // (digits & -digits)
+    return run & (run + 1) == 0
+
+
+# Позиция маски - 10-битная маска цифр (бит d - цифра d). X отличается от [0-9]
+# отдельным 11-м битом: старый строковый оптимизатор различал их при группировке
+ALL_DIGITS = (1 << 10) - 1
+X = ALL_DIGITS | 1 << 10
+RANGE = -1 # Маркер позиции-диапазона в шаблоне merge_adjacent
+TOKENS = {f'[{low}-{high}]': digit_range(low, high) for low in range(10) for high in range(low + 1, 10)}
+TOKENS.update({str(digit): 1 << digit for digit in range(10)})
+TOKENS['X'] = X
+TOKEN_TEXT = {position: token for token, position in TOKENS.items()}
+
+
+def optimize_patterns_in_memory(
+        patterns: list[str], 
+        optimization_lvl: int | None = None, 
+        max_cycles: int = OPTIMIZATION_MAX_CYCLES) -> list[str]:
+    """
+    optimization_lvl - ровно столько циклов проходов. None - крутить циклы,
+    пока очередной цикл не перестанет менять шаблоны, но не больше max_cycles.
+    """
     logger.info(f"Starting in-memory optimization for {len(patterns)} patterns")
-    
-    optimized_lines = patterns
-    for i in range(optimization_lvl):
-        logger.debug(f'Optimization cycle: {i}')
-        optimized_lines = optimize_patterns(optimized_lines)
-        optimized_lines = compress_sequential_patterns(optimized_lines)
-        optimized_lines = sort_lines_by_def_code(optimized_lines)
-        optimized_lines = merge_adjacent_ranges(optimized_lines)
+    if optimization_lvl is not None and optimization_lvl < 1:
+        return sort_lines_by_def_code(patterns)
+
+    cycles = optimization_lvl if optimization_lvl is not None else max_cycles
+
+    # Разбираем строки один раз, проходы работают с PatternIR
+    optimized_lines = [pattern for pattern in map(parse_ir, patterns) if pattern is not None]
+    signature = (len(optimized_lines), hash(tuple(optimized_lines)))
+    passes = (
+        ('optimize_patterns', optimize_patterns_ir),
+        ('compress_sequential', compress_sequential_ir),
+        ('sort_by_def_code', sort_ir_by_def_code),
+        ('merge_adjacent_ranges', merge_adjacent_ir),
+    )
+    for i in range(cycles):
+        for name, optimization_pass in passes:
+            with stage(f'cycle{i}/{name}', len(optimized_lines)) as metrics:
+                optimized_lines = optimization_pass(optimized_lines)
+                metrics.items_out = len(optimized_lines)
+
+        if optimization_lvl is None:
+            # Дешёвая проверка неподвижной точки: число строк и хэш всего набора
+            previous, signature = signature, (len(optimized_lines), hash(tuple(optimized_lines)))
+            if signature == previous:
+                logger.info(f'Patterns converged after {i + 1} cycles')
+                break
+
+    else:
+        if optimization_lvl is None:
+            logger.warning(f'Patterns did not converge in {max_cycles} cycles')
 
     logger.info(f'Final sorting of {len(optimized_lines)} lines')
-    optimized_lines = sort_lines_by_def_code(optimized_lines)
-    
-    return optimized_lines
+    optimized_lines = sort_ir_by_def_code(optimized_lines)
 
+    return [render_ir(pattern) for pattern in optimized_lines]
 
-def optimize_patterns(patterns: list[str]) -> list[str]:
-    logger.info('\nOptimizing patterns')
-    parsed_patterns: list[Pattern] = []
-    for pattern in patterns:
-        # До: "exten = _[78]91234567[0-9]X,1,GoSub"
-        # После: prefix="91234567", mask=['[0-9]', 'X']
-        pattern_obj = parse_pattern(pattern)
-        if pattern_obj.prefix and pattern_obj.mask:
-            parsed_patterns.append(pattern_obj)
 
-    logger.debug(f'{parsed_patterns=}')
+def parse_ir(line: str) -> PatternIR | None:
+    # "exten = _[78]90[0-1]5XX,1,GoSub" -> prefix="90", mask=(0b11, 0b100000, X, X)
+    if not line.startswith('exten = _[78]'):
+        return None
 
-    groups: dict[tuple[str, int], list[Pattern]]= {}
-    for pattern in parsed_patterns:
-        key = (pattern.prefix, len(pattern.mask)) # Группируем по префиксу и длине маски
-        if key not in groups:
-            groups[key] = []
+    end = line.rfind(',1,GoSub')
+    if end == -1:
+        return None
 
-        groups[key].append(pattern)
+    body = line[13:end]
+    i = 0
+    while i < len(body) and '0' <= body[i] <= '9':
+        i += 1
 
-    logger.debug(f'{groups=}')
+    if i == 0:
+        return None
 
-    merged_patterns: list[Pattern] = []
-    for key, group_patterns in groups.items():
-        if len(group_patterns) == 1:
-            # Если не с чем объединять добавляем так
-            merged_patterns.append(group_patterns[0])
+    prefix = body[:i]
+    mask = []
+    while i < len(body):
+        size = 5 if body[i] == '[' else 1
+        token = body[i:i + size]
+        if token not in TOKENS:
+            return None
 
-        else:
-            # Если несколько шаблонов объединяем
-            merged_masks = merge_masks([pattern.mask for pattern in group_patterns])
-            for mask in merged_masks:
-                merged_patterns.append(Pattern(key[0], mask))
+        mask.append(TOKENS[token])
+        i += size
 
-    logger.debug(f'{merged_patterns=}')
+    return PatternIR(prefix, tuple(mask), line)
 
-    # Заменяем диапазоны [0-9] на Х
-    x_replaced: list[Pattern] = []
-    for merg_pattern in merged_patterns:
-        new_mask = []
-        for char in merg_pattern.mask:
 
-            if char.startswith('[') and char.endswith(']'):
-                range_match = re.match(r'\[(\d)-(\d)\]', char)
+def render_position(position: int) -> str:
+    # Полный диапазон из слияния остаётся [0-9], в X его превращает только optimize_patterns
+    return TOKEN_TEXT[position]
 
-                if range_match and int(range_match.group(1)) == 0 and int(range_match.group(2)) == 9:
-                    new_mask.append('X')
 
-                else:
-                    new_mask.append(char)
+def render_ir(pattern: PatternIR) -> str:
+    if pattern.original is not None:
+        return pattern.original
 
-            else:
-                new_mask.append(char)
-                
-        x_replaced.append(Pattern(merg_pattern.prefix, new_mask))
-
-    logger.debug(f'{x_replaced=}')
-
-    # Группируем по шаблонам с Х
-    x_groups: dict[tuple, list[Pattern]] = {}
-    for pattern in x_replaced:
-        # Создаем ключ, заменяя X на специальный маркер '_X_'
-        key_parts = [pattern.prefix]
-        for char in pattern.mask:
-            key_parts.append('_X_' if char == 'X' else char)
-
-        key = tuple(key_parts)
-        
-        if key not in x_groups:
-            x_groups[key] = []
-
-        x_groups[key].append(pattern)
-    logger.debug(f'{x_groups=}')
-
-    # Объединяем похожие маски в группах
-    final_patterns: list[Pattern] = []
-    for key, group_patterns in x_groups.items():
-        # Один в группе добавляем в финальный вид
-        if len(group_patterns) == 1: 
-            final_patterns.append(group_patterns[0])
-
-        # Объединяем маски, заменяя различающиеся позиции на X
-        else:
-            merged_mask = merge_similar_masks([pattern.mask for pattern in group_patterns])
-            final_patterns.append(Pattern(group_patterns[0].prefix, merged_mask)) # 0 т.к. префикс у всех одинаков
-    logger.debug(f'{final_patterns=}')
+    mask = ''.join([TOKEN_TEXT[position] for position in pattern.mask])
+    return f'exten = _[78]{pattern.prefix}{mask},1,GoSub(${{ARG1}},${{EXTEN}},1)'
 
 
-    # Собираем строку обратно
-    result = [pattern.to_string() for pattern in final_patterns]
-    logger.debug(f'{result=}')
+def optimize_patterns(patterns: list[str]) -> list[str]:
+    parsed = [pattern for pattern in map(parse_ir, patterns) if pattern is not None]
+    return [render_ir(pattern) for pattern in optimize_patterns_ir(parsed)]
 
-    return result
+
+def optimize_patterns_ir(patterns: list[PatternIR]) -> list[PatternIR]:
+    logger.info('\nOptimizing patterns')
+    groups: dict[tuple[str, int], list[PatternIR]] = {}
+    for pattern in patterns:
+        if pattern.prefix and pattern.mask:
+            key = (pattern.prefix, len(pattern.mask)) # Группируем по префиксу и длине маски
+            if key not in groups:
+                groups[key] = []
+
+            groups[key].append(pattern)
+
+    # Словарь вместо списка: одинаковые шаблоны после замены [0-9] на X схлопываются, порядок сохраняется
+    final_patterns: dict[PatternIR, None] = {}
+    for (prefix, _), group_patterns in groups.items():
+        if len(group_patterns) == 1:
+            masks = [group_patterns[0].mask]
+
+        else:
+            masks = merge_positions([pattern.mask for pattern in group_patterns])
+
+        for mask in masks:
+            # Заменяем диапазоны [0-9] на Х
+            mask = tuple(X if position == ALL_DIGITS else position for position in mask)
+            final_patterns.setdefault(PatternIR(prefix, mask), None)
+
+    return list(final_patterns)
 
 
 def parse_pattern(pattern: str) -> Pattern:
@@ -122,36 +155,31 @@ def parse_pattern(pattern: str) -> Pattern:
         prefix = match.group(1) # Извлекаем префикс - 9001234
         mask_str = match.group(2) # Извлекаем маску - XX
         mask = split_mask(mask_str) # Разбиваем на части
-        logger.debug(f'Return data: {prefix, mask}')
+        trace('Return data: %s %s', prefix, mask)
 
         return Pattern(prefix, mask)
     
-    logger.debug(f'Return data: None, None')
+    trace('Return data: None, None')
     return Pattern('', [])
 
 
 def split_mask(mask_str: str) -> list[str]:
     elements = [] # Результат сохраняется сюда
     i = 0
-    logger.debug('Starting spliting masks')
     while i < len(mask_str):
-        logger.debug(f'Cicle number: {i}')
         if mask_str[i] == '[':
             # Нашли начало диапазона - ищем конец
             j = mask_str.find(']', i)
             if j != -1:
-                logger.debug(f'j != -1; j = {j}')
                 # Добавляем весь диапазон как один элемент
                 elements.append(mask_str[i: j + 1])
                 i = j + 1 # Перескакиваем на позицию после ]   
 
             else:
-                logger.debug('j = -1')
                 elements.append(mask_str[i])
                 i += 1
 
         else:
-            logger.debug(f'msk_str[i] = {mask_str[i]}')
             # Обычный символ - добавляем как есть
             elements.append(mask_str[i])
             i += 1
@@ -160,67 +188,33 @@ def split_mask(mask_str: str) -> list[str]:
 
 
 def merge_masks(masks: list[list[str]]) -> list[list[str]]:
-    logger.debug('Starting merging masks')
-    if not masks:
-        return []
-    
-    mask_length = len(masks[0]) # Предполагается что все маски одинаковой длины
-    position_values: list[set[str]] = [] # Значение для каждой позиции
-    
-    # Для каждой позиции в маске собираем все возможные значения
-    for i in range(mask_length):
-        all_values = set() # собираем уникальные значения
-        for mask in masks:
-            char = mask[i]
+    positions = [tuple(TOKENS[token] for token in mask) for mask in masks]
+    merged = merge_positions(positions)
+    if merged is positions:
+        return masks
 
-            # Если символ X то добавляем все цифры что он заменяет
-            if char == 'X': 
-                all_values.update(str(d) for d in range(10)) 
+    return [[render_position(position) for position in mask] for mask in merged]
 
-            # Находим паттерн и все числа которые он собой представляет [1-3] = 1, 2, 3
-            elif char.startswith('[') and char.endswith(']'):
-                range_match = re.match(r'\[(\d)-(\d)\]', char)
-                if range_match:
-                    start, end = int(range_match.group(1)), int(range_match.group(2))
-                    all_values.update(str(d) for d in range(start, end + 1))
-
-            # Если символ 1 то просто добавляем его
-            else:
-                all_values.add(char)
-        logger.debug(f'{all_values=}')
-
-        position_values.append(all_values)
-    logger.debug(f'{position_values=}')
 
+def merge_positions(masks: list[tuple]) -> list[tuple]:
+    """
+    Объединяет маски одной длины поразрядно. Каждая позиция результата -
+    объединение цифр всех масок; если хоть в одной позиции оно не сплошное,
+    возвращаются исходные маски.
+    """
     merged_mask = []
-    for values in position_values:
-        # Только одно возможное значение - используем его как есть
-        if len(values) == 1:
-            merged_mask.append(next(iter(values)))
-
-        else:
-            # Несколько значений - пытаемся создать диапазон
-            digits = [int(v) for v in values if v.isdigit()]
+    for positions in zip(*masks):
+        digits = 0
+        for position in positions:
+            digits |= position
 
-            if not digits:
-                # Нет цифровых значений или нельзя объединить - используем 'X'
-                merged_mask.append('X')
+        digits &= ALL_DIGITS
+        if not is_contiguous(digits):
+            return masks
 
-            # Находим минимальную и максимальную цифру и создаем срез
-            min_digit = min(digits)
-            max_digit = max(digits)
-            expected = set(str(i) for i in range(min_digit, max_digit + 1))
-            # Проверяем, совпадает ли ожидаемый диапазон с фактическими значениями и создаем диапазон
-            if expected == values:
-                merged_mask.append(f"[{min_digit}-{max_digit}]")
+        merged_mask.append(digits)
 
-            else:
-                logger.debug(f'Can`t merge masks: {masks}')
-                # Не можем объединить - возвращаем исходные маски
-                return masks
-            
-    logger.debug(f'{merged_mask=}')
-    return [merged_mask]
+    return [tuple(merged_mask)] if masks else []
 
 
 def merge_similar_masks(masks: list[list[str]]) -> list[str]:
@@ -240,135 +234,89 @@ def merge_similar_masks(masks: list[list[str]]) -> list[str]:
             else next(iter(position_chars))
         )
 
-    logger.debug(f'{result_mask=}')
+    trace('result_mask=%s', result_mask)
     return result_mask
 
 
 def compress_sequential_patterns(patterns: list[str]) -> list[str]:
     if len(patterns) <= 1:
         return patterns
-    
+
+    parsed = [parse_ir(pattern) for pattern in patterns]
+    compressed = compress_sequential_ir([pattern for pattern in parsed if pattern is not None])
+    # Неразобранные строки сжать нельзя, отдаём их как есть
+    return [render_ir(pattern) for pattern in compressed] + [line for line, pattern in zip(patterns, parsed) if pattern is None]
+
+
+def compress_sequential_ir(patterns: list[PatternIR]) -> list[PatternIR]:
+    if len(patterns) <= 1:
+        return patterns
+
     logger.info(f"\nStarting compression of {len(patterns)} patterns")
-    
-    # Парсим паттерны более простым способом
-    parsed_items: list[PatternItem] = []
+
+    # Группируем по количеству X в конце и по базовой части (без последней цифры)
+    groups: dict[tuple[str, tuple, int], list[tuple[int, PatternIR]]] = {}
     for pattern in patterns:
-        # Извлекаем основную часть между _[78] и ,1,GoSub
-        start_idx = pattern.find('_[78]') + 5
-        end_idx = pattern.find(',1,GoSub')
-        if start_idx == 4 or end_idx == -1:
-            parsed_items.append(
-                PatternItem(
-                    pattern,
-                    '',
-                    0,
-                    '')
-                )
-            continue
-            
-        pattern_body = pattern[start_idx:end_idx]
-        
-        # Считаем количество X в конце
+        mask = pattern.mask
         x_count = 0
-        for char in reversed(pattern_body):
-            if char == 'X':
-                x_count += 1
-
-            else:
-                break
-        
-        # Извлекаем цифровую часть (все что до X)
-        digit_part = pattern_body[:-x_count] if x_count > 0 else pattern_body
-        
-        parsed_items.append(
-            PatternItem(
-                pattern,
-                digit_part,
-                x_count,
-                pattern_body
-            )
-        )
-    logger.debug(f'{parsed_items=}')
+        while x_count < len(mask) and mask[len(mask) - x_count - 1] == X:
+            x_count += 1
 
-    # Группируем по количеству X и по базовой части (без последней цифры)
-    groups: dict[tuple[str, int], list[tuple[int, PatternItem]]] = {}
-    for item in parsed_items:
-        if item.x_count == 0 or not item.digit_part:
+        if x_count == 0:
             continue
-            
-        digit_part = item.digit_part
-        
-        # Берем базовую часть без последней цифры
-        if len(digit_part) > 1:
-            base_part = digit_part[:-1]
-            last_digit = digit_part[-1]
+
+        head = mask[:len(mask) - x_count]
+        if head:
+            # Последняя позиция перед X должна быть одной цифрой, диапазон уже сжат
+            if head[-1] & (head[-1] - 1):
+                continue
+
+            key = (pattern.prefix, head[:-1], x_count)
+            last_digit = head[-1].bit_length() - 1
+
+        elif pattern.prefix:
+            key = (pattern.prefix[:-1], (), x_count)
+            last_digit = int(pattern.prefix[-1])
 
         else:
-            base_part = ""
-            last_digit = digit_part
-        
-        if last_digit.isdigit():
-            key = (base_part, item.x_count)
-            if key not in groups:
-                groups[key] = []
+            continue
+
+        if key not in groups:
+            groups[key] = []
+
+        groups[key].append((last_digit, pattern))
 
-            groups[key].append((int(last_digit), item))
-    logger.debug(f'{groups=}')
-    
     # Сжимаем последовательные цифры
-    compressed_patterns: list[str] = []
+    compressed_patterns: list[PatternIR] = []
     processed = set()
-    for key, digit_items in groups.items():
-        base_part, x_count = key
-        
-        # Сортируем по цифре
+    for (prefix, head, x_count), digit_items in groups.items():
         digit_items.sort(key = lambda x: x[0]) # Лямбда для удобства вызова без вынесения микрофункции в отдельную
-        
+
         # Находим последовательные диапазоны
         current_range = [digit_items[0]]
-        ranges: list[list[tuple[int, PatternItem]]] = []
-        
+        ranges: list[list[tuple[int, PatternIR]]] = []
         for i in range(1, len(digit_items)):
-            current_digit = digit_items[i][0]
-            prev_digit = digit_items[i-1][0]
-            
-            if current_digit == prev_digit + 1:
+            if digit_items[i][0] == digit_items[i - 1][0] + 1:
                 current_range.append(digit_items[i])
 
             else:
-                if len(current_range) >= 2:  # Минимум 2 последовательных числа
+                if len(current_range) >= 2: # Минимум 2 последовательных числа
                     ranges.append(current_range)
                 current_range = [digit_items[i]]
-        
+
         if len(current_range) >= 2:
             ranges.append(current_range)
-        
-        # Создаем сжатые паттерны для найденных диапазонов
+
         for range_items in ranges:
-            if len(range_items) < 2:
-                continue
-                
-            start_digit = range_items[0][0]
-            end_digit = range_items[-1][0]
-            
-            # Создаем новый паттерн
-            new_digit_part = f"{base_part}[{start_digit}-{end_digit}]"
-            new_pattern_body = f"{new_digit_part}{'X' * x_count}"
-            new_pattern = f"exten = _[78]{new_pattern_body},1,GoSub(${{ARG1}},${{EXTEN}},1)"
-            
-            compressed_patterns.append(new_pattern)
-            
+            digits = digit_range(range_items[0][0], range_items[-1][0])
+            compressed_patterns.append(PatternIR(prefix, head + (digits,) + (X,) * x_count))
+
             # Помечаем исходные паттерны как обработанные
-            for digit, item in range_items:
-                processed.add(item.original)
-        # logger.debug(f'{processed=}')
+            processed.update(pattern for _, pattern in range_items)
 
     # Добавляем необработанные паттерны
-    for item in parsed_items:
-        if item.original not in processed:
-            compressed_patterns.append(item.original)
-    
-    logger.debug(f'{compressed_patterns=}')
+    compressed_patterns.extend(pattern for pattern in patterns if pattern not in processed)
+
     logger.info(f"Compression completed: {len(patterns)} -> {len(compressed_patterns)} patterns")
     return compressed_patterns
 
@@ -390,179 +338,98 @@ def sort_lines_by_def_code(lines: list[str]) -> list[str]:
         else:
             other_lines.append(line)
     
-    logger.debug(f'{len(pattern_lines)=}')
-    # Сортируем паттерны по DEF-коду
-    pattern_lines.sort(key = extract_def_code)
-    logger.debug(f'{len(pattern_lines)=}')
+    # Сортируем паттерны по DEF-коду и границам номеров, ключ считается один раз на строку
+    pattern_lines.sort(key = line_sort_key)
 
     return header_lines + pattern_lines + other_lines
 
 
-def extract_def_code(line: str) -> int:
-    # Ищем DEF-код в формате _[78]XXX
-    match = re.search(r'_\[78\](\d{3})', line)
-    if match:
-        return int(match.group(1))
-    # Если DEF-код не найден, возвращаем максимальное значение для размещения в конце
-    logger.debug('DEF not found return inf')
-    return float('inf')
+def line_sort_key(line: str) -> tuple:
+    pattern = parse_ir(line)
+    if pattern is None:
+        # Неразобранные строки - после всех шаблонов, между собой по тексту
+        return (float('inf'), 0, 0, line, ())
+
+    return ir_sort_key(pattern)
+
+
+def ir_sort_key(pattern: PatternIR) -> tuple:
+    """
+    DEF-код, наименьший и наибольший номер шаблона, затем сам шаблон -
+    порядок полный и не зависит от порядка на входе. Шаблоны без DEF-кода
+    в начале уходят в конец.
+    """
+    low = high = int(pattern.prefix) if pattern.prefix else 0
+    for position in pattern.mask:
+        digits = position & ALL_DIGITS
+        low = low * 10 + (digits & -digits).bit_length() - 1
+        high = high * 10 + digits.bit_length() - 1
+
+    def_code = int(pattern.prefix[:3]) if len(pattern.prefix) >= 3 else float('inf')
+    return (def_code, low, high, pattern.prefix, pattern.mask)
+
+
+def sort_ir_by_def_code(patterns: list[PatternIR]) -> list[PatternIR]:
+    logger.info('\nStarting sorting all lines')
+    # После первого цикла список почти упорядочен: timsort сливает готовые отрезки, а не сортирует заново
+    return sorted(patterns, key = ir_sort_key)
 
 
 def merge_adjacent_ranges(patterns: list[str]) -> list[str]:
     if len(patterns) <= 1:
         return patterns
-    
+
+    parsed = [parse_ir(pattern) for pattern in patterns]
+    merged = merge_adjacent_ir([pattern for pattern in parsed if pattern is not None])
+    # Если паттерн не соответствует формату, просто добавляем его как есть
+    return [line for line, pattern in zip(patterns, parsed) if pattern is None] + [render_ir(pattern) for pattern in merged]
+
+
+def merge_adjacent_ir(patterns: list[PatternIR]) -> list[PatternIR]:
+    if len(patterns) <= 1:
+        return patterns
+
     logger.info(f"\nMerging adjacent ranges for {len(patterns)} patterns")
-    
-    # Группируем паттерны по базовой части (без диапазонов)
-    pattern_groups = defaultdict(list)
-    merged_patterns: list[str] = []
-    
+
+    # Группируем паттерны по префиксу и маске, в которой диапазоны заменены маркером
+    pattern_groups: dict[tuple, list[PatternIR]] = defaultdict(list)
+    merged_patterns: list[PatternIR] = []
     for pattern in patterns:
-        # Извлекаем основную часть
-        match = re.match(r'exten = _\[78\](\d+)(.*),1,GoSub', pattern)
-        if not match:
-            # Если паттерн не соответствует формату, просто добавляем его как есть
+        if not pattern.prefix:
             merged_patterns.append(pattern)
             continue
-            
-        prefix = match.group(1)
-        mask_str = match.group(2)
-        
-        # Находим позиции диапазонов [x-y]
-        range_positions: list[tuple[int, str]] = []
-        clean_mask: list[str] = []
-        i = 0
-        while i < len(mask_str):
-            if mask_str[i] != '[':
-                clean_mask.append(mask_str[i])
-                i += 1
 
-            else:
-                j = mask_str.find(']', i)
-                if j != -1:
-                    range_positions.append((len(clean_mask), mask_str[i:j+1]))
-                    clean_mask.append('R')  # Заменяем диапазон на маркер
-                    i = j + 1
-
-                else:
-                    clean_mask.append(mask_str[i])
-                    i += 1      
-        
-        # Создаем ключ для группировки
-        key = (prefix, ''.join(clean_mask))
-        pattern_groups[key].append((pattern, range_positions))
-    logger.debug(f'{pattern_groups.keys()=}')
-
-    # Объединяем диапазоны в каждой группе
-    for key, group_patterns in pattern_groups.items():
-        prefix, mask_template = key
-        
+        # Одиночная цифра и X остаются в ключе как есть, остальное - диапазон
+        template = tuple(RANGE if position != X and position & (position - 1) else position for position in pattern.mask)
+        pattern_groups[(pattern.prefix, template)].append(pattern)
+
+    for (prefix, template), group_patterns in pattern_groups.items():
         # Если в группе только один паттерн, просто добавляем его
         if len(group_patterns) == 1:
-            merged_patterns.append(group_patterns[0][0])
+            merged_patterns.append(group_patterns[0])
             continue
-            
-        # Собираем все диапазоны для каждой позиции
-        position_ranges = defaultdict(list)
-        for pattern, range_positions in group_patterns:
-            for pos, range_str in range_positions:
-                position_ranges[pos].append(range_str)
-        
-        # Пытаемся объединить диапазоны в каждой позиции
-        merged_ranges = {}
-        can_merge = True
-        
-        for pos, ranges in position_ranges.items():
-            if len(ranges) == 1:
-                merged_ranges[pos] = ranges[0]
+
+        # Объединяем диапазоны в каждой позиции, они должны остаться сплошными
+        result_mask = list(template)
+        for pos, position in enumerate(template):
+            if position is not RANGE:
                 continue
-                
-            # Собираем все цифры из диапазонов
-            all_digits = set()
-            for range_str in ranges:
-                range_match = re.match(r'\[(\d)-(\d)\]', range_str)
-                if range_match:
-                    start, end = int(range_match.group(1)), int(range_match.group(2))
-                    all_digits.update(range(start, end + 1))
-
-                else:
-                    # Если не удалось распарсить диапазон, не можем объединить
-                    can_merge = False
-                    break
-            
-            if not all_digits or not can_merge:
-                can_merge = False
-                break
 
-            min_digit = min(all_digits)
-            max_digit = max(all_digits)
-            expected_digits = set(range(min_digit, max_digit + 1))
-            
-            if all_digits == expected_digits:
-                merged_ranges[pos] = f"[{min_digit}-{max_digit}]"
+            digits = 0
+            for pattern in group_patterns:
+                digits |= pattern.mask[pos]
 
-            else:
-                # Не можем объединить - оставляем исходные диапазоны
-                can_merge = False
+            if not is_contiguous(digits):
                 break
-        
-        # Если не можем объединить все диапазоны, добавляем все исходные паттерны
-        if not can_merge or len(merged_ranges) != len(position_ranges):
-            for pattern, _ in group_patterns:
-                merged_patterns.append(pattern)
-            continue
-        
-        # Создаем объединенный паттерн
-        result_mask = build_result_mask(mask_template, merged_ranges, group_patterns)
-        logger.debug(f'{result_mask}')
 
-        # Создаем новый паттерн
-        new_pattern = f"exten = _[78]{prefix}{''.join(result_mask)},1,GoSub(${{ARG1}},${{EXTEN}},1)"
-        merged_patterns.append(new_pattern)
-    logger.debug(f'{merged_patterns=}')
-
-    logger.info(f"После объединения: {len(merged_patterns)} паттернов")
-    return merged_patterns
-
-
-def build_result_mask(
-        mask_template: str, 
-        merged_ranges: dict[int, str], 
-        group_patterns: list[tuple[str, list[tuple[int, str]]]]) -> list[int]: 
-    
-    result_mask = []
-    marker_index = 0
-    
-    # Подготавливаем источник замен
-    replacement_source = create_replacement_source(merged_ranges, group_patterns)
-    logger.debug(f'{replacement_source=}')
-    
-    for char in mask_template:
-        if char == 'R':
-            replacement = replacement_source.get(marker_index, 'X')
-            result_mask.append(replacement)
-            marker_index += 1
+            result_mask[pos] = digits
 
         else:
-            result_mask.append(char)
-    
-    logger.debug(f'{result_mask=}')
-    return result_mask
+            merged_patterns.append(PatternIR(prefix, tuple(result_mask)))
+            continue
 
+        # Не можем объединить - оставляем исходные паттерны
+        merged_patterns.extend(group_patterns)
 
-def create_replacement_source(
-        merged_ranges: dict[int, str],
-        group_patterns: list[tuple[str, list[tuple[int, str]]]]) -> dict[int, str]:
-    
-    source = {}
-    source.update(merged_ranges)  # Сначала объединенные диапазоны
-    
-    # Затем добавляем из первого шаблона (только недостающие)
-    if group_patterns and group_patterns[0][1]:
-        for pos, range_str in group_patterns[0][1]:
-            if pos not in source:
-                source[pos] = range_str
-    logger.debug(f'{source=}')
-
-    return source
+    logger.info(f"После объединения: {len(merged_patterns)} паттернов")
+    return merged_patterns
@@ -0,0 +1,123 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from types import FrameType
+from typing import Iterator
+
+from cfg import PROFILE_DIR, PROFILE_INTERVAL, logger
+from metrics import get_report, set_stage_profiler
+
+PROFILERS : tuple[str, ...] = ('cprofile', 'sample')
+
+
+class StageProfiler:
+    """
+    cProfile на каждый этап отчёта: <directory>/<этап>.prof, смотреть
+    через python -m pstats или snakeviz. Вложенный этап попадает в профиль
+    внешнего - два cProfile одновременно в одном процессе не работают.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._active = False
+
+    @contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        if self._active:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self._active = True
+        profile.enable()
+        try:
+            yield
+
+        finally:
+            profile.disable()
+            self._active = False
+            path = os.path.join(self.directory, f'{name.replace("/", "_")}.prof')
+            profile.dump_stats(path)
+            logger.info(f'Profile of stage {name} written to {path}')
+
+
+class StackSampler:
+    """
+    Раз в interval секунд снимает стек главного потока и считает одинаковые
+    стеки. Корень каждого стека - имя текущего этапа, поэтому во flamegraph
+    этапы видны отдельно. Формат collapsed: 'этап;f1;f2 число' на строку.
+    """
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._thread_id = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = 'StackSampler', daemon = True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                report = get_report()
+                root = report.current if report else ''
+                self.stacks[';'.join([root or 'main', *frame_names(frame)])] += 1
+
+    def write(self, path: str) -> None:
+        with open(path, 'w', encoding = 'utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        logger.info(f'{sum(self.stacks.values())} stack samples written to {path}')
+
+
+def frame_names(frame: FrameType | None) -> list[str]:
+    # От корня к листу, как ждёт flamegraph.pl
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+
+    return names[::-1]
+
+
+@contextmanager
+def profiling(mode: str | None, directory: str = PROFILE_DIR) -> Iterator[None]:
+    """
+    mode=cprofile - профиль на каждый этап, mode=sample - один collapsed-файл
+    stacks.collapsed для flamegraph.pl или speedscope. None - без профилирования.
+    """
+    if mode is None:
+        yield
+        return
+
+    if mode not in PROFILERS:
+        raise ValueError(f'Unknown profiler {mode}, expected one of {PROFILERS}')
+
+    os.makedirs(directory, exist_ok = True)
+    if mode == 'cprofile':
+        set_stage_profiler(StageProfiler(directory))
+        try:
+            yield
+
+        finally:
+            set_stage_profiler(None)
+
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+
+        finally:
+            sampler.stop()
+            sampler.write(os.path.join(directory, 'stacks.collapsed'))
@@ -0,0 +1,153 @@
+from collections import defaultdict, deque
+from typing import Iterable
+
+
+def decompose_range(start: int, end: int, width: int = 7) -> list[str]:
+    """
+    Раскладывает [start, end] на шаблоны из цифр, одного класса [a-b] и X
+    для номеров длиной width. Порядок шаблонов тот же, что давал старый
+    range_of_numbers (обход в ширину: левый край, середины, правый край).
+    """
+    if start < 0 or start > end:
+        raise ValueError(f'Bad range {start}-{end}')
+
+    if end >= 10 ** width:
+        raise ValueError(f'Range end {end} does not fit in {width} digits')
+
+    patterns = []
+    queue = deque([('', start, end, width)])
+
+    while queue:
+        common, low, high, k = queue.popleft()
+        unit = 10 ** (k - 1) # Вес текущего разряда
+        low_digit, low_rest = divmod(low, unit)
+        high_digit, high_rest = divmod(high, unit)
+
+        # Хвост покрывает разряды целиком - закрываем шаблон X-ами
+        if low_rest == 0 and high_rest == unit - 1:
+            if low_digit == high_digit:
+                digit = str(low_digit)
+
+            elif low_digit == 0 and high_digit == 9:
+                digit = 'X'
+
+            else:
+                digit = f'[{low_digit}-{high_digit}]'
+
+            patterns.append(common + digit + 'X' * (k - 1))
+            continue
+
+        # Общая цифра - просто спускаемся на разряд ниже
+        if low_digit == high_digit:
+            queue.append((common + str(low_digit), low_rest, high_rest, k - 1))
+            continue
+
+        # Левый край, целые середины и правый край
+        queue.append((common + str(low_digit), low_rest, unit - 1, k - 1))
+        for digit in range(low_digit + 1, high_digit):
+            queue.append((common + str(digit), 0, unit - 1, k - 1))
+
+        queue.append((common + str(high_digit), 0, high_rest, k - 1))
+
+    return patterns
+
+
+def coalesce_intervals(intervals: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    # Сортируем и склеиваем пересекающиеся и соседние интервалы
+    merged: list[list[int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+
+        else:
+            merged.append([start, end])
+
+    return [(start, end) for start, end in merged]
+
+
+def cover_range(start: int, end: int, width: int) -> list[tuple[tuple[int, int], ...]]:
+    """
+    Минимальное покрытие [start, end] шаблонами вида цифры + [a-b] + X.
+    Каждая позиция шаблона - пара (меньшая цифра, большая цифра),
+    шаблоны идут по возрастанию номеров.
+    """
+    if width == 0:
+        return [()]
+
+    unit = 10 ** (width - 1)
+    low_digit, low_rest = divmod(start, unit)
+    high_digit, high_rest = divmod(end, unit)
+    tail = ((0, 9),) * (width - 1)
+
+    if low_rest == 0 and high_rest == unit - 1:
+        return [((low_digit, high_digit),) + tail]
+
+    if low_digit == high_digit:
+        return [((low_digit, low_digit),) + rest for rest in cover_range(low_rest, high_rest, width - 1)]
+
+    result = []
+    first_full, last_full = low_digit, high_digit
+
+    # Неполные края раскладываем глубже, полные цифры уходят в общий класс середины
+    if low_rest != 0:
+        result.extend(((low_digit, low_digit),) + rest for rest in cover_range(low_rest, unit - 1, width - 1))
+        first_full += 1
+
+    if high_rest != unit - 1:
+        last_full -= 1
+
+    if first_full <= last_full:
+        result.append(((first_full, last_full),) + tail)
+
+    if high_rest != unit - 1:
+        result.extend(((high_digit, high_digit),) + rest for rest in cover_range(0, high_rest, width - 1))
+
+    return result
+
+
+def merge_columns(patterns: list[tuple[tuple[int, int], ...]]) -> list[tuple[tuple[int, int], ...]]:
+    # Шаблоны, которые отличаются только одной позицией с соседними цифрами, объединяются без потери точности
+    if not patterns:
+        return patterns
+
+    for position in reversed(range(len(patterns[0]))):
+        groups: dict[tuple, list[tuple[int, int]]] = defaultdict(list)
+        for pattern in patterns:
+            groups[pattern[:position] + pattern[position + 1:]].append(pattern[position])
+
+        patterns = []
+        for key, digit_ranges in groups.items():
+            if len(digit_ranges) > 1:
+                digit_ranges = coalesce_intervals(digit_ranges)
+
+            for digit_range in digit_ranges:
+                patterns.append(key[:position] + (digit_range,) + key[position:])
+
+    return sorted(patterns)
+
+
+def render_pattern(pattern: tuple[tuple[int, int], ...]) -> str:
+    parts = []
+    for low, high in pattern:
+        if low == high:
+            parts.append(str(low))
+
+        elif low == 0 and high == 9:
+            parts.append('X')
+
+        else:
+            parts.append(f'[{low}-{high}]')
+
+    return ''.join(parts)
+
+
+def minimal_patterns(intervals: Iterable[tuple[int, int]], width: int) -> list[str]:
+    """
+    Стратегия merged: склеить интервалы, покрыть каждый минимальным
+    набором шаблонов и объединить шаблоны соседних интервалов по позициям.
+    """
+    patterns = []
+    for start, end in coalesce_intervals(intervals):
+        patterns.extend(cover_range(start, end, width))
+
+    return [render_pattern(pattern) for pattern in merge_columns(patterns)]
@@ -0,0 +1,196 @@
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+
+import requests
+from requests.exceptions import RequestException
+
+from cache import (
+    commit_download_meta,
+    conditional_headers,
+    load_download_meta,
+    partial_meta_path,
+    save_pending_download_meta,
+)
+from cfg import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_HEADERS,
+    STREAM_QUEUE_SIZE,
+    CriticalError,
+    DownloadMeta,
+    logger
+)
+
+
+class RegistryStream(io.RawIOBase):
+    """
+    Сырой поток тела HTTP ответа. Сеть читается в отдельном потоке в ограниченную
+    очередь, поэтому разбор csv идёт параллельно со скачиванием. При tee=True
+    байты по пути пишутся в <filename>.part для кэша.
+    """
+    def __init__(
+            self,
+            response: requests.Response,
+            filename: str,
+            cached_meta: DownloadMeta | None,
+            tee: bool = True,
+            settings: dict | None = None):
+        self.response = response
+        self.filename = filename
+        self.cached_meta = cached_meta
+        self.tee = tee
+        self.settings = settings
+
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.started = time.perf_counter()
+        self.meta: DownloadMeta | None = None
+
+        self._chunks: queue.Queue[bytes | None] = queue.Queue(maxsize = STREAM_QUEUE_SIZE)
+        self._buffer = memoryview(b'')
+        self._error: BaseException | None = None
+        self._stopped = threading.Event()
+        self._eof = False
+        self._text: io.TextIOWrapper | None = None
+        self._thread = threading.Thread(target = self._produce, name = 'registry-download', daemon = True)
+        self._thread.start()
+
+    def _produce(self) -> None:
+        part = open(f'{self.filename}.part', 'wb') if self.tee else None
+        try:
+            for chunk in self.response.iter_content(chunk_size = DOWNLOAD_CHUNK_SIZE):
+                if part:
+                    part.write(chunk)
+
+                self.digest.update(chunk)
+                self.size += len(chunk)
+                if not self._put(chunk):
+                    return # Читатель закрыл поток раньше времени
+
+        except BaseException as e:
+            self._error = e
+
+        finally:
+            if part:
+                part.close()
+
+            self.response.close()
+            self._put(None)
+
+    def _put(self, item: bytes | None) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout = 0.1)
+                return True
+
+            except queue.Full:
+                continue
+
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            if self._eof:
+                return 0
+
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+                if self._error:
+                    logger.critical(f'Registry stream interrupted after {self.size} bytes: {self._error}')
+                    raise CriticalError from self._error
+
+                return 0
+
+            self._buffer = memoryview(chunk)
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self) -> None:
+        self._stopped.set()
+        super().close()
+
+    def text(self) -> io.TextIOWrapper:
+        # Держим ссылку на обёртку, иначе сборщик мусора закроет поток до finish()
+        if self._text is None:
+            self._text = io.TextIOWrapper(io.BufferedReader(self, DOWNLOAD_CHUNK_SIZE), encoding = 'utf-8-sig', newline = '')
+
+        return self._text
+
+    def finish(self) -> bool:
+        """
+        Дочитывает хвост ответа, сохраняет файл в кэш и возвращает False,
+        если содержимое совпало с последним успешно обработанным.
+        """
+        while self.readinto(bytearray(DOWNLOAD_CHUNK_SIZE)):
+            pass # Разбор мог остановиться раньше конца файла, хэш считаем по всему телу
+
+        self._thread.join()
+
+        elapsed = time.perf_counter() - self.started
+        speed = self.size / elapsed / 1024 / 1024 if elapsed > 0 else 0.0
+        logger.info(f'Streamed {self.size} bytes in {elapsed:.2f}s ({speed:.2f} MiB/s)')
+
+        self.meta = DownloadMeta(
+            etag = self.response.headers.get('ETag'),
+            last_modified = self.response.headers.get('Last-Modified'),
+            sha256 = self.digest.hexdigest(),
+            size = self.size,
+        )
+
+        if not self.tee:
+            return not (self.cached_meta and self.cached_meta.sha256 == self.meta.sha256)
+
+        os.replace(f'{self.filename}.part', self.filename)
+        save_pending_download_meta(self.filename, self.meta)
+        if self.cached_meta and self.cached_meta.sha256 == self.meta.sha256:
+            logger.info(f'Registry content unchanged (sha256 {self.meta.sha256})')
+            commit_download_meta(self.filename, self.settings)
+            return False
+
+        return True
+
+
+def open_registry_stream(
+        filename: str,
+        url: str,
+        use_cache: bool = True,
+        tee: bool = True,
+        settings: dict | None = None) -> RegistryStream | None:
+    # Тот же условный запрос, что и в download_file: None означает 304
+    headers = dict(DOWNLOAD_HEADERS)
+
+    cached_meta = load_download_meta(filename, settings) if use_cache else None
+    if cached_meta and os.path.exists(filename) and os.path.getsize(filename) == cached_meta.size:
+        headers.update(conditional_headers(cached_meta))
+
+    else:
+        cached_meta = None
+
+    if tee and os.path.exists(partial_meta_path(filename)):
+        # .part будет перезаписан потоком, докачивать его через Range больше нельзя
+        os.remove(partial_meta_path(filename))
+
+    try:
+        response = requests.get(url, stream = True, headers = headers, timeout = 30)
+        if response.status_code == 304:
+            response.close()
+            logger.info(f'Registry not modified on server, using cached {filename}')
+            return None
+
+        response.raise_for_status()
+
+    except RequestException as e:
+        logger.critical(f'Can`t open registry stream {url}: {e}')
+        raise CriticalError from e
+
+    return RegistryStream(response, filename, cached_meta, tee, settings)
@@ -0,0 +1,104 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from cfg import (
+    OperatorRegistry, 
+    PatternLine, 
+    PatternLines, 
+    RowData, 
+    get_default_operators, 
+    get_operator_registry, 
+    get_operator_to_inn
+)
+
+
+class TestOperatorRegistry(unittest.TestCase):
+    def tearDown(self):
+        get_operator_registry.cache_clear()
+
+
+    def test_lookups(self):
+        # arrange
+        registry = OperatorRegistry(get_default_operators())
+
+        # act / assert
+        self.assertEqual(registry.inn('mts'), '7740000076')
+        self.assertEqual(registry.name('7740000076'), 'mts')
+        self.assertIsNone(registry.name('0000000000'))
+        self.assertEqual(registry.inns_for(['mts', 'unknown', 'yota']), frozenset({'7740000076', '7701725181'}))
+
+
+    def test_registry_is_built_once(self):
+        get_operator_registry.cache_clear()
+
+        self.assertIs(get_operator_registry(), get_operator_registry())
+        self.assertEqual(get_operator_to_inn('7812014560'), 'megafon')
+
+
+    def test_operators_from_file(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'operators.json')
+            with open(path, 'w', encoding = 'utf-8') as f:
+                json.dump({'sber': '7707083893'}, f)
+
+            get_operator_registry.cache_clear()
+
+            # act
+            with mock.patch('cfg.OPERATORS_FILE', path):
+                registry = get_operator_registry()
+
+            # assert
+            self.assertEqual(registry.name('7707083893'), 'sber')
+            self.assertEqual(registry.inn('mts'), '7740000076', msg = 'Стандартные операторы должны остаться')
+
+
+class TestCompactStorage(unittest.TestCase):
+    def test_row_data_packs_numbers(self):
+        row = RowData('933', '0004444', '0004449', 'ПАО "МТС"', '7740000076')
+
+        self.assertEqual((row.def_code, row.start_input, row.end_input), (933, 4444, 4449))
+        self.assertFalse(hasattr(row, '__dict__'), msg = 'RowData должен быть со __slots__')
+
+
+    def test_pattern_lines(self):
+        # arrange
+        lines = PatternLines()
+        mts = lines.operator_id('ПАО "МТС"', '7740000076')
+        beeline = lines.operator_id('ПАО "ВЫМПЕЛКОМ"', '7713076301')
+
+        # act
+        lines.append(933, '7704444', mts)
+        lines.append(906, '96XXXXX', beeline)
+        lines.append(900, '96XXXXX', mts)
+
+        # assert
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines.operator_id('ПАО "МТС"', '7740000076'), mts)
+        self.assertEqual(list(lines), [
+            PatternLine('_[78]9337704444', 'ПАО "МТС"', '7740000076'),
+            PatternLine('_[78]90696XXXXX', 'ПАО "ВЫМПЕЛКОМ"', '7713076301'),
+            PatternLine('_[78]90096XXXXX', 'ПАО "МТС"', '7740000076'),
+        ])
+        self.assertIs(lines.bodies[1], lines.bodies[2], msg = 'Одинаковые хвосты шаблонов должны быть одним объектом')
+
+
+    def test_pattern_lines_extend_and_pickle(self):
+        # arrange
+        first = PatternLines()
+        first.append(933, '1XXXXXX', first.operator_id('A', '1'))
+        second = PatternLines()
+        second.append(934, '2XXXXXX', second.operator_id('B', '2'))
+        second.append(935, '3XXXXXX', second.operator_id('A', '1'))
+
+        # act
+        first.extend(pickle.loads(pickle.dumps(second)))
+
+        # assert
+        self.assertEqual([line.operator_name for line in first], ['A', 'B', 'A'])
+        self.assertEqual(len(first.operators), 2)
+        self.assertEqual(first[2].pattern, '_[78]9353XXXXXX')
@@ -0,0 +1,474 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+from functools import partial
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import commit_download_meta, load_download_meta
+from cfg import CriticalError
+from main import download_file, iter_csv_rows, main, parse_content_range, parse_digest_header, read_csv_file
+from streaming import open_registry_stream
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    # Локальная замена opendata.digital.gov.ru, содержимое задаётся через server.payload
+    def do_GET(self):
+        payload: bytes = self.server.payload
+        etag: str | None = self.server.etag
+        self.server.requests.append(dict(self.headers))
+
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass # Не засоряем вывод тестов
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Отдаёт только server.drop_after байт и рвёт соединение, пока не кончатся server.drops
+    def do_GET(self):
+        payload: bytes = self.server.payload
+        self.server.requests.append(dict(self.headers))
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') in (None, self.server.etag):
+            start = int(range_header.removeprefix('bytes=').rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(payload) - 1}/{len(payload)}')
+
+        else:
+            self.send_response(200)
+
+        body = payload[start:]
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Digest', 'sha-256=' + base64.b64encode(hashlib.sha256(payload).digest()).decode())
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if self.server.drops > 0:
+            self.server.drops -= 1
+            self.wfile.write(body[:self.server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+    # Сжимает тело, если клиент согласен на gzip или если так задано в server.force_gzip
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        body = self.server.payload
+        compress = self.server.force_gzip or 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        self.send_response(200)
+        if compress:
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+    def __init__(self, payload: bytes, etag: str | None = None, handler: type[BaseHTTPRequestHandler] = RegistryHandler):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.payload = payload
+        self.server.etag = etag
+        self.server.requests = []
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/DEF-9xx.csv'
+
+    @property
+    def requests(self) -> list[dict]:
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_payload(rows: int) -> bytes:
+    lines = ['ABC/ DEF;От;До;Емкость;Оператор;Регион;Территория ГАР;ИНН']
+    for i in range(rows):
+        lines.append(f'9{i % 100:02d};{i % 10}000000;{i % 10}999999;1000000;ПАО "МТС";Регион;Регион;7740000076')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class TestDownload(unittest.TestCase):
+    def test_download_file_streaming(self):
+        # arrange
+        payload = make_payload(5000)
+
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload) as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertEqual(result, filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), payload, msg = 'Содержимое файла не совпадает')
+
+            # Временный файл после переименования не остаётся
+            self.assertFalse(os.path.exists(f'{filename}.part'))
+
+
+    def test_download_file_keeps_old_file_on_error(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            with open(filename, 'wb') as f:
+                f.write(b'old')
+
+            # act
+            with self.assertRaises(CriticalError):
+                download_file(filename, url = 'http://127.0.0.1:1/DEF-9xx.csv', retries = 0)
+
+            # assert
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), b'old')
+
+
+class TestDownloadCache(unittest.TestCase):
+    def test_not_modified_with_etag(self):
+        # arrange
+        payload = make_payload(100)
+
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload, etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            self.assertEqual(download_file(filename, url = server.url), filename)
+            commit_download_meta(filename) # Прогон завершился успешно
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertIsNone(result, msg = 'Неизменённый реестр должен отдавать None')
+            self.assertEqual(server.requests[-1].get('If-None-Match'), '"v1"')
+            self.assertEqual(load_download_meta(filename).etag, '"v1"')
+
+
+    def test_changed_registry_is_downloaded(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(make_payload(100), etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            download_file(filename, url = server.url)
+            commit_download_meta(filename)
+
+            server.server.payload = make_payload(200)
+            server.server.etag = '"v2"'
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertEqual(result, filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), make_payload(200))
+
+
+    def test_same_hash_without_validators(self):
+        # arrange
+        payload = make_payload(100)
+
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload) as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            download_file(filename, url = server.url)
+            commit_download_meta(filename)
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertIsNone(result)
+
+
+    def test_uncommitted_run_is_not_cached(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(make_payload(100), etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            download_file(filename, url = server.url) # Прогон упал до commit_download_meta
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertEqual(result, filename)
+            self.assertNotIn('If-None-Match', server.requests[-1])
+
+
+    def test_other_settings_are_not_cached(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(make_payload(100), etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            download_file(filename, url = server.url, settings = {'operators': ['mts'], 'strategy': 'passes'})
+            commit_download_meta(filename, {'operators': ['mts'], 'strategy': 'passes'})
+
+            # act
+            result = download_file(filename, url = server.url, settings = {'operators': ['beeline', 'mts'], 'strategy': 'passes'})
+
+            # assert
+            self.assertEqual(result, filename, msg = 'Прогон с другими операторами должен собрать конфиги заново')
+            self.assertNotIn('If-None-Match', server.requests[-1])
+            self.assertIsNone(download_file(filename, url = server.url, settings = {'operators': ['mts'], 'strategy': 'passes'}))
+
+
+    def test_download_asks_for_uncompressed_body(self):
+        # arrange
+        payload = make_payload(5000)
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload, handler = GzipHandler) as server:
+            server.server.force_gzip = False
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act
+            result = download_file(filename, url = server.url)
+
+            # assert
+            self.assertEqual(server.requests[0]['Accept-Encoding'], 'identity')
+            with open(result, 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+
+    def test_download_gzip_encoded_body(self):
+        # arrange
+        payload = make_payload(5000)
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload, handler = GzipHandler) as server:
+            server.server.force_gzip = True # Сервер сжимает, не глядя на Accept-Encoding
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act
+            result = download_file(filename, url = server.url, retries = 0)
+
+            # assert
+            with open(result, 'rb') as f:
+                self.assertEqual(f.read(), payload, msg = 'В кэше лежит распакованный реестр')
+
+            commit_download_meta(filename)
+            self.assertEqual(load_download_meta(filename).size, len(payload), msg = 'Размер для проверки кэша - распакованный')
+            self.assertFalse(os.path.exists(f'{filename}.part'))
+
+
+    def test_main_skips_pipeline_when_not_changed(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_file = os.path.join(temp_dir, 'run_report.json')
+            with mock.patch('main.CACHE_DIR', temp_dir), \
+                 mock.patch('main.RUN_REPORT_FILENAME', report_file), \
+                 mock.patch('main.download_file', return_value = None), \
+                 mock.patch('main.read_csv_file') as read_mock, \
+                 mock.patch('main.upload_multiple_files_to_gitea') as upload_mock:
+
+                main(['mts'], filename = 'DEF-9xx.csv')
+
+                read_mock.assert_not_called()
+                upload_mock.assert_not_called()
+
+            with open(report_file, encoding = 'utf-8') as f:
+                report = json.load(f)
+
+            self.assertEqual(report['status'], 'unchanged')
+            self.assertEqual([stage['name'] for stage in report['stages']], ['download'])
+
+
+    def test_failed_upload_keeps_meta_pending(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(make_payload(100), etag = '"v1"') as server:
+            with mock.patch('main.CACHE_DIR', temp_dir), \
+                 mock.patch('main.download_file', partial(download_file, url = server.url)), \
+                 mock.patch('main.OUTPUT_DIR_NAME', os.path.join(temp_dir, 'operators')), \
+                 mock.patch('main.RUN_REPORT_FILENAME', os.path.join(temp_dir, 'run_report.json')), \
+                 mock.patch('main.remote_file_shas', return_value = {}), \
+                 mock.patch('main.requests.post', return_value = mock.Mock(ok = False, status_code = 500, text = 'error')):
+
+                # act
+                with self.assertRaises(CriticalError):
+                    main(['mts'], filename = 'DEF-9xx.csv')
+
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # assert
+            self.assertTrue(os.path.exists(f'{filename}.meta.pending'), msg = 'Неудачная выгрузка не фиксирует версию реестра')
+            self.assertIsNone(load_download_meta(filename))
+            with open(os.path.join(temp_dir, 'run_report.json'), encoding = 'utf-8') as f:
+                self.assertEqual(json.load(f)['status'], 'failed')
+
+
+class TestResumableDownload(unittest.TestCase):
+    def setUp(self):
+        # Без пауз между повторами и с мелкими блоками, чтобы обрыв приходился на границу блока
+        for name, value in (('main.DOWNLOAD_BACKOFF', 0), ('main.DOWNLOAD_CHUNK_SIZE', 10_000)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def make_server(self, payload: bytes, drops: int, drop_after: int) -> LocalServer:
+        server = LocalServer(payload, etag = '"v1"', handler = FlakyHandler)
+        server.server.drops = drops
+        server.server.drop_after = drop_after
+        return server
+
+
+    def test_resume_after_dropped_connections(self):
+        # arrange
+        payload = make_payload(20000)
+
+        with tempfile.TemporaryDirectory() as temp_dir, self.make_server(payload, drops = 3, drop_after = 100_000) as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act
+            result = download_file(filename, url = server.url, retries = 5)
+
+            # assert
+            self.assertEqual(result, filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+            # Каждый повтор продолжает с того места, где оборвалось
+            ranges = [r.get('Range') for r in server.requests]
+            self.assertEqual(ranges, [None, 'bytes=100000-', 'bytes=200000-', 'bytes=300000-'])
+            self.assertTrue(all(r.get('If-Range') == '"v1"' for r in server.requests[1:]))
+            self.assertFalse(os.path.exists(f'{filename}.part'))
+
+
+    def test_partial_file_survives_failed_run(self):
+        # arrange
+        payload = make_payload(20000)
+
+        with tempfile.TemporaryDirectory() as temp_dir, self.make_server(payload, drops = 2, drop_after = 50_000) as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            with self.assertRaises(CriticalError):
+                download_file(filename, url = server.url, retries = 1)
+
+            self.assertEqual(os.path.getsize(f'{filename}.part'), 100_000)
+
+            # act - следующий запуск докачивает остаток
+            result = download_file(filename, url = server.url, retries = 1)
+
+            # assert
+            self.assertEqual(result, filename)
+            self.assertEqual(server.requests[-1].get('Range'), 'bytes=100000-')
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+
+    def test_changed_file_restarts_from_zero(self):
+        # arrange
+        payload = make_payload(20000)
+
+        with tempfile.TemporaryDirectory() as temp_dir, self.make_server(payload, drops = 1, drop_after = 50_000) as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            with self.assertRaises(CriticalError):
+                download_file(filename, url = server.url, retries = 0)
+
+            # Пока мы ждали, реестр обновился
+            server.server.payload = make_payload(30000)
+            server.server.etag = '"v2"'
+
+            # act
+            result = download_file(filename, url = server.url, retries = 0)
+
+            # assert
+            self.assertEqual(result, filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), make_payload(30000))
+
+
+    def test_parse_content_range(self):
+        self.assertEqual(parse_content_range('bytes 100-199/1000'), (100, 1000))
+        self.assertEqual(parse_content_range('bytes 100-199/*'), (100, None))
+
+
+    def test_parse_digest_header(self):
+        digest = hashlib.sha256(b'data').digest()
+
+        self.assertEqual(parse_digest_header('md5=abc, sha-256=' + base64.b64encode(digest).decode()), digest)
+        self.assertIsNone(parse_digest_header(None))
+
+
+class TestRegistryStream(unittest.TestCase):
+    def test_stream_rows_match_file_rows(self):
+        # arrange
+        payload = make_payload(20000)
+
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(payload, etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act
+            with open_registry_stream(filename, server.url) as registry:
+                rows = list(iter_csv_rows(registry.text()))
+                changed = registry.finish()
+
+            # assert
+            self.assertTrue(changed)
+            self.assertEqual(rows, list(read_csv_file(filename)), msg = 'Строки из потока и из файла отличаются')
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), payload, msg = 'Копия потока в кэше отличается')
+
+
+    def test_stream_not_modified(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir, LocalServer(make_payload(100), etag = '"v1"') as server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+            with open_registry_stream(filename, server.url) as registry:
+                list(iter_csv_rows(registry.text()))
+                registry.finish()
+            commit_download_meta(filename)
+
+            # act
+            result = open_registry_stream(filename, server.url)
+
+            # assert
+            self.assertIsNone(result)
+
+
+    def test_stream_interrupted(self):
+        # arrange
+        server = LocalServer(make_payload(20000), etag = '"v1"', handler = FlakyHandler)
+        server.server.drops = 1
+        server.server.drop_after = 100_000
+
+        with tempfile.TemporaryDirectory() as temp_dir, server:
+            filename = os.path.join(temp_dir, 'DEF-9xx.csv')
+
+            # act / assert
+            with open_registry_stream(filename, server.url) as registry:
+                with self.assertRaises(CriticalError):
+                    list(iter_csv_rows(registry.text()))
+
+            self.assertFalse(os.path.exists(filename))
@@ -1,14 +1,31 @@
 import csv
+import io
 import os
 import tempfile
 import unittest
 from unittest import mock
 
-from cfg import PatternLine, RowData
+from cache import load_snapshot, save_snapshot, write_file_atomic
+from cfg import CriticalError, PatternLine, RowData
 from main import (
+    cached_decompose_range,
+    collect_intervals,
+    git_blob_sha,
     grouping_lines, 
+    main,
+    optimize_incremental,
+    optimize_operator,
+    optimize_parsed,
+    parse_file_parallel,
+    parse_rows,
+    parsing_rows,
     range_of_numbers, 
     read_csv_file,
+    read_csv_file_fast,
+    remove_stale_configs,
+    render_operator_config,
+    split_file,
+    upload_multiple_files_to_gitea,
     write_operator_config
 )
 
@@ -43,6 +60,34 @@ class TestMain(unittest.TestCase):
             self.assertEqual(data[2], lines[3], msg = f'Строки не совпадают')  
 
     
+    def test_read_csv_file_fast(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_file = os.path.join(temp_dir, 'test.csv')
+            with open(temp_file, 'w', encoding='utf-8-sig', newline='') as f:
+                lines = [
+                    ['ABC/ DEF', 'От', 'До', 'Емкость', 'Оператор', 'Регион', 'Территория', 'ИНН'],
+                    ['933', '1630000', '1649999', '20000', 'ООО "Т2 МОБАЙЛ"', 'Алтайский край', 'Алтайский край', '7743895280'],
+                    ['906', '9600000', '9699999', '100000', 'ПАО "ВЫМПЕЛКОМ"', 'Алтайский край', 'Алтайский край', '7713076301'],
+                    ['923', '5680000', '5699999', '20000', 'ПАО "МЕГАФОН"', 'Край; с точкой с запятой', 'Алтайский край', '7812014560'],
+                    ['999', '0000000', '0000099', '100', 'ООО "Другой"', 'Алтайский край', 'Алтайский край', '1234567890'],
+                ]
+
+                writer = csv.writer(f, delimiter = ';') # Пишет с \r\n и кавычками
+                writer.writerows(lines)
+
+            selected_inns = ['7743895280', '7812014560']
+
+            # act
+            fast = list(read_csv_file_fast(temp_file, selected_inns))
+            regular = [row for row in read_csv_file(temp_file) if row[4] in selected_inns]
+
+            # assert
+            self.assertEqual(fast, regular, msg = 'Быстрое чтение отличается от csv.reader')
+            self.assertEqual(len(fast), 2)
+            self.assertEqual(fast[1][3], 'ПАО "МЕГАФОН"')
+
+
     def test_range_of_numbers_single(self):
         row_data = RowData('933', '7704444', '7704444', 'Test Operator', '1234567890')
         
@@ -74,6 +119,40 @@ class TestMain(unittest.TestCase):
             self.assertTrue(pattern_line.pattern.startswith('_[78]900'))
     
 
+    def test_range_of_numbers_cache(self):
+        # arrange
+        cached_decompose_range.cache_clear()
+        first = RowData('900', '3360000', '3449999', 'Test Operator', '1234567890')
+        second = RowData('977', '3360000', '3449999', 'Test Operator', '1234567890')
+
+        # act
+        first_lines = range_of_numbers(first)
+        second_lines = range_of_numbers(second)
+
+        # assert
+        info = cached_decompose_range.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1), msg = 'Тот же диапазон в другом DEF-коде берётся из кэша')
+        self.assertEqual([line.pattern.replace('_[78]977', '') for line in second_lines], [line.pattern.replace('_[78]900', '') for line in first_lines])
+
+
+    def test_parsing_rows_skips_bad_def_code(self):
+        # arrange
+        raw_data = [
+            ['70000', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+            ['-1', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+            ['1000', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+            ['910', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+        ]
+
+        # act
+        with self.assertLogs('App', level = 'ERROR') as logs:
+            result = parsing_rows(raw_data, ['mts'])
+
+        # assert
+        self.assertEqual([line.pattern for line in result], ['_[78]9100000XXX'])
+        self.assertEqual(len(logs.records), 3, msg = 'Каждая плохая строка пропущена с ошибкой в логе')
+
+
     def test_grouping_lines(self):
         test_data = [
             PatternLine('_[78]9337704444', 'МТС', '7713076301'),
@@ -118,4 +197,347 @@ class TestMain(unittest.TestCase):
                     content = f.read()
                     self.assertIn('[mts_codes]', content)
                     self.assertIn('_[78]9337704444', content)
-    
\ No newline at end of file
+
+
+    def test_render_operator_config(self):
+        # arrange
+        patterns = ['_[78]9337704444', 'exten = _[78]9337704XXX,1,GoSub(${ARG1},${EXTEN},1)']
+
+        # act
+        content = render_operator_config('mts', patterns)
+
+        # assert
+        self.assertEqual(content.splitlines(), [
+            '[mts_codes]',
+            'exten = _[78]9337704444,1,GoSub(${ARG1},${EXTEN},1)',
+            'exten = _[78]9337704XXX,1,GoSub(${ARG1},${EXTEN},1)',
+            'exten = _XXXX!,1,Return()',
+            'exten = _XXXX!,2,Hangup()',
+        ])
+        self.assertTrue(content.endswith('\n'))
+
+
+    def test_write_operator_config_keeps_old_file_on_error(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, 'mts_conf.cfg')
+            with open(filepath, 'w', encoding = 'utf-8-sig') as f:
+                f.write('old config\n')
+
+            # act
+            with mock.patch('cache.os.replace', side_effect = OSError('disk full')):
+                with self.assertRaises(OSError):
+                    write_operator_config({'mts': ['_[78]9337704444'], 'beeline': ['_[78]9337704XXX']}, temp_dir)
+
+            with open(filepath, encoding = 'utf-8-sig') as f:
+                content = f.read()
+
+            files = sorted(os.listdir(temp_dir))
+
+        # assert
+        self.assertEqual(content, 'old config\n', msg = 'Старый конфиг не должен портиться')
+        self.assertEqual(files, ['mts_conf.cfg'], msg = 'Временные файлы удаляются')
+    
+
+
+    def test_parse_file_parallel(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_file = os.path.join(temp_dir, 'test.csv')
+            inns = ['7743895280', '7713076301', '7812014560', '1234567890']
+            with open(temp_file, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f, delimiter = ';')
+                writer.writerow(['ABC/ DEF', 'От', 'До', 'Емкость', 'Оператор', 'Регион', 'Территория', 'ИНН'])
+                for i in range(500):
+                    start = (i * 7919) % 9000000
+                    writer.writerow([str(900 + i % 100), f'{start:07d}', f'{start + i * 37:07d}', '1', 'ПАО "Тест"', 'Регион', 'Регион', inns[i % 4]])
+
+            operators = ['tele2', 'beeline', 'megafon']
+
+            # act
+            single = parsing_rows(read_csv_file_fast(temp_file, ['7743895280', '7713076301', '7812014560']), operators)
+            parallel, (hits, misses) = parse_file_parallel(temp_file, operators, workers = 3)
+            chunks = split_file(temp_file, 7)
+
+            # assert
+            self.assertEqual(parallel, single, msg = 'Параллельный разбор должен совпадать с однопроцессным')
+            self.assertEqual(hits + misses, 375, msg = 'Счётчики кэша диапазонов из дочерних процессов суммируются')
+            self.assertEqual(len(chunks), 7)
+            with open(temp_file, 'rb') as f:
+                data = f.read()
+            for start, end in chunks:
+                self.assertEqual(data[start - 1:start], b'\n', msg = 'Кусок должен начинаться с новой строки')
+
+
+    def test_parse_file_parallel_missing_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.assertRaises(CriticalError), self.assertLogs('App', level = 'CRITICAL'):
+                parse_file_parallel(os.path.join(temp_dir, 'missing.csv'), ['mts'], 2)
+
+
+    def test_merged_strategy(self):
+        # arrange
+        raw_data = [
+            ['933', '1630000', '1639999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['933', '1640000', '1649999', 'ООО "Т2 МОБАЙЛ"', '7743895280'], # Продолжение предыдущего диапазона
+            ['906', '9600000', '9699999', 'ПАО "ВЫМПЕЛКОМ"', '7713076301'],
+            ['923', '5680000', '5699999', 'ПАО "МЕГАФОН"', '7812014560'], # Не выбран
+            ['906', '9700000', '9600000', 'ПАО "ВЫМПЕЛКОМ"', '7713076301'], # Битая строка
+        ]
+
+        # act
+        intervals = collect_intervals(raw_data, ['tele2', 'beeline'])
+        result = optimize_parsed(intervals, 'merged', optimization_lvl = 2)
+
+        # assert
+        self.assertEqual(intervals['tele2'], [(9331630000, 9331639999), (9331640000, 9331649999)])
+        self.assertEqual(result, {
+            'tele2': ['exten = _[78]93316[3-4]XXXX,1,GoSub(${ARG1},${EXTEN},1)'],
+            'beeline': ['exten = _[78]90696XXXXX,1,GoSub(${ARG1},${EXTEN},1)'],
+        })
+
+
+    def test_optimize_operators_in_workers(self):
+        # arrange
+        parsed = parsing_rows([
+            ['933', '1630000', '1631999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['906', '9600000', '9609999', 'ПАО "ВЫМПЕЛКОМ"', '7713076301'],
+            ['910', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+            ['910', '0002000', '0002999', 'ПАО "МТС"', '7740000076'],
+        ], ['tele2', 'beeline', 'mts'])
+
+        # act
+        with self.assertLogs('App', level = 'INFO') as logs:
+            parallel = optimize_parsed(parsed, 'passes', None, workers = 2)
+
+        sequential = optimize_parsed(parsed, 'passes', None)
+
+        # assert
+        self.assertEqual(parallel, sequential, msg = 'Результат не должен зависеть от числа процессов')
+        self.assertEqual(list(parallel), ['tele2', 'beeline', 'mts'], msg = 'Порядок операторов как на входе')
+        self.assertTrue(
+            any(record.processName != 'MainProcess' and 'in-memory optimization' in record.getMessage() for record in logs.records),
+            msg = 'Логи дочерних процессов должны попадать в логгер App'
+        )
+
+
+    def test_incremental_reuses_unchanged_partitions(self):
+        # arrange
+        rows = [
+            ['933', '1630000', '1639999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['933', '1640000', '1649999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['977', '0000000', '0999999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['906', '9600000', '9699999', 'ПАО "ВЫМПЕЛКОМ"', '7713076301'],
+        ]
+        updated = [list(row) for row in rows]
+        updated[1][2] = '1659999' # Поменялся один диапазон в 933
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_file = os.path.join(temp_dir, 'snapshot')
+            fresh_file = os.path.join(temp_dir, 'fresh')
+
+            # act
+            first = optimize_incremental(rows, ['tele2', 'beeline'], 'passes', None, snapshot_file)
+            with mock.patch('main.optimize_operator', wraps = optimize_operator) as optimize:
+                second = optimize_incremental(updated, ['tele2', 'beeline'], 'passes', None, snapshot_file)
+
+            fresh = optimize_incremental(updated, ['tele2', 'beeline'], 'passes', None, fresh_file)
+
+        # assert
+        self.assertEqual(optimize.call_count, 1, msg = 'Пересобираться должна только изменившаяся часть')
+        self.assertEqual(second, fresh, msg = 'Результат со снимком должен совпадать с полным пересчётом')
+        self.assertNotEqual(first['tele2'], second['tele2'])
+        self.assertEqual(first['beeline'], second['beeline'])
+        self.assertEqual(second['tele2'][-1], 'exten = _[78]9770XXXXXX,1,GoSub(${ARG1},${EXTEN},1)', msg = 'DEF-коды по возрастанию')
+
+
+    def test_incremental_skips_bad_def_code(self):
+        # arrange
+        rows = [
+            ['9x3', '1630000', '1639999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['977', '0000000', '0999999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+        ]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # act
+            with self.assertLogs('App', level = 'ERROR'):
+                result = optimize_incremental(rows, ['tele2'], 'passes', None, os.path.join(temp_dir, 'snapshot'))
+
+        # assert
+        self.assertEqual(result, {'tele2': ['exten = _[78]9770XXXXXX,1,GoSub(${ARG1},${EXTEN},1)']})
+
+
+    def test_snapshot_keys_with_colon(self):
+        # arrange
+        partitions = {('mvno:east', 977): {'hash': 'a', 'lines': []}, ('mts', 910): {'hash': 'b', 'lines': []}}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'snapshot')
+
+            # act
+            save_snapshot(path, {'strategy': 'passes'}, partitions)
+            loaded = load_snapshot(path, {'strategy': 'passes'})
+
+        # assert
+        self.assertEqual(loaded, partitions, msg = 'Имя оператора с двоеточием не ломает ключ части')
+
+
+    def test_trie_strategy(self):
+        # arrange
+        raw_data = [
+            ['933', '1630000', '1639999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['933', '1640000', '1649999', 'ООО "Т2 МОБАЙЛ"', '7743895280'],
+            ['934', '1630000', '1649999', 'ООО "Т2 МОБАЙЛ"', '7743895280'], # Тот же блок в соседнем DEF-коде
+        ]
+
+        # act
+        result = optimize_parsed(parse_rows(raw_data, ['tele2'], 'trie'), 'trie', optimization_lvl = 2)
+
+        # assert
+        self.assertEqual(result, {'tele2': ['exten = _[78]93[3-4]16[3-4]XXXX,1,GoSub(${ARG1},${EXTEN},1)']})
+
+
+    def test_main_local_input_without_upload(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'registry.csv')
+            with open(input_file, 'w', encoding = 'utf-8-sig', newline = '') as f:
+                writer = csv.writer(f, delimiter = ';')
+                writer.writerow(['ABC/ DEF', 'От', 'До', 'Емкость', 'Оператор', 'Регион', 'Территория', 'ИНН'])
+                writer.writerow(['910', '0000000', '0099999', '100000', 'ПАО "МТС"', 'г. Москва', 'г. Москва', '7740000076'])
+
+            output_dir = os.path.join(temp_dir, 'operators')
+            with mock.patch('main.CACHE_DIR', temp_dir), \
+                 mock.patch('main.OUTPUT_DIR_NAME', output_dir), \
+                 mock.patch('main.RUN_REPORT_FILENAME', os.path.join(temp_dir, 'run_report.json')), \
+                 mock.patch('main.download_file') as download_mock, \
+                 mock.patch('main.upload_multiple_files_to_gitea') as upload_mock:
+
+                # act
+                main(['mts'], input_file = input_file, upload = False)
+
+            with open(os.path.join(output_dir, 'mts_conf.cfg'), encoding = 'utf-8-sig') as f:
+                config = f.read()
+
+        # assert
+        download_mock.assert_not_called()
+        upload_mock.assert_not_called()
+        self.assertIn('exten = _[78]91000XXXXX,1,GoSub', config)
+
+
+    def test_main_logs_range_cache_once(self):
+        # arrange
+        cached_decompose_range.cache_clear()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'registry.csv')
+            with open(input_file, 'w', encoding = 'utf-8-sig', newline = '') as f:
+                writer = csv.writer(f, delimiter = ';')
+                writer.writerow(['ABC/ DEF', 'От', 'До', 'Емкость', 'Оператор', 'Регион', 'Территория', 'ИНН'])
+                for def_code in ('910', '911'):
+                    writer.writerow([def_code, '0000000', '0099999', '100000', 'ПАО "МТС"', 'г. Москва', 'г. Москва', '7740000076'])
+
+            with mock.patch('main.CACHE_DIR', temp_dir), \
+                 mock.patch('main.OUTPUT_DIR_NAME', os.path.join(temp_dir, 'operators')), \
+                 mock.patch('main.RUN_REPORT_FILENAME', os.path.join(temp_dir, 'run_report.json')):
+
+                # act
+                with self.assertLogs('App', level = 'INFO') as logs:
+                    main(['mts'], input_file = input_file, upload = False, incremental = True)
+
+        # assert
+        stats = [record.getMessage() for record in logs.records if record.getMessage().startswith('Range cache')]
+        self.assertEqual(stats, ['Range cache: 1 hits, 1 misses (50.0%)'], msg = 'Статистика кэша одна на прогон, а не на каждую часть')
+
+
+    def test_main_stdin_dry_run(self):
+        # arrange
+        registry = io.StringIO(
+            'ABC/ DEF;От;До;Емкость;Оператор;Регион;Территория;ИНН\n'
+            '910;0000000;0099999;100000;ПАО "МТС";г. Москва;г. Москва;7740000076\n'
+        )
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_dir = os.path.join(temp_dir, 'out')
+            with mock.patch('main.CACHE_DIR', temp_dir), \
+                 mock.patch('main.RUN_REPORT_FILENAME', os.path.join(temp_dir, 'run_report.json')), \
+                 mock.patch('main.open_stdin', return_value = registry), \
+                 mock.patch('main.upload_multiple_files_to_gitea') as upload_mock, \
+                 mock.patch('builtins.print') as print_mock:
+
+                # act
+                main(['mts'], input_file = '-', output_dir = output_dir, dry_run = True)
+
+            files = os.listdir(output_dir)
+
+        # assert
+        upload_mock.assert_not_called()
+        self.assertEqual(files, ['mts_conf.cfg'])
+        printed = ' '.join(str(call.args[0]) for call in print_mock.call_args_list)
+        self.assertIn('mts_conf.cfg', printed, msg = 'dry run печатает план выгрузки')
+
+
+    def test_git_blob_sha(self):
+        # Тот же sha, что у git hash-object
+        self.assertEqual(git_blob_sha(b'hello\n'), 'ce013625030ba8dba906f756967f9e9ca394464a')
+
+
+    def test_write_operator_config_skips_unchanged(self):
+        # arrange
+        grouped = {'mts': ['_[78]9337704444'], 'beeline': ['_[78]9337704XXX']}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first = write_operator_config(grouped, temp_dir)
+            mtime = os.stat(os.path.join(temp_dir, 'beeline_conf.cfg')).st_mtime_ns
+
+            # act
+            with mock.patch('main.write_file_atomic', wraps = write_file_atomic) as write_mock:
+                second = write_operator_config({**grouped, 'mts': ['_[78]9337704XXX']}, temp_dir)
+
+            # assert
+            self.assertEqual(first, ['mts', 'beeline'])
+            self.assertEqual(second, ['mts'], msg = 'Перезаписывается только изменившийся конфиг')
+            self.assertEqual(write_mock.call_count, 1)
+            self.assertEqual(os.stat(os.path.join(temp_dir, 'beeline_conf.cfg')).st_mtime_ns, mtime)
+
+            with open(os.path.join(temp_dir, 'mts_conf.cfg'), encoding = 'utf-8-sig') as f:
+                self.assertTrue(f.read().startswith('[mts_codes]\n'), msg = 'Заголовок есть и при перезаписи')
+
+
+    def test_upload_drops_unchanged_files(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write_operator_config({'mts': ['_[78]9337704444'], 'beeline': ['_[78]9337704XXX']}, temp_dir)
+            with open(os.path.join(temp_dir, 'beeline_conf.cfg'), 'rb') as f:
+                beeline_sha = git_blob_sha(f.read())
+
+            listing = mock.Mock(status_code = 200)
+            listing.json.return_value = [
+                {'path': 'beeline_conf.cfg', 'type': 'file', 'sha': beeline_sha},
+                {'path': 'mts_conf.cfg', 'type': 'file', 'sha': 'old'},
+                {'path': 'docs', 'type': 'dir', 'sha': 'tree'},
+            ]
+
+            with mock.patch('main.requests.get', return_value = listing) as get_mock, \
+                 mock.patch('main.requests.post', return_value = mock.Mock(ok = True)) as post_mock:
+
+                # act
+                upload_multiple_files_to_gitea('http://gitea', 'token', 'owner', 'repo', output_dir = temp_dir)
+
+                with open(os.path.join(temp_dir, 'mts_conf.cfg'), 'rb') as f:
+                    listing.json.return_value[1]['sha'] = git_blob_sha(f.read())
+
+                upload_multiple_files_to_gitea('http://gitea', 'token', 'owner', 'repo', output_dir = temp_dir)
+
+        # assert
+        self.assertEqual(get_mock.call_count, 2, msg = 'Один запрос списка файлов на выгрузку')
+        self.assertEqual(post_mock.call_count, 1, msg = 'Без изменений коммит не создаётся')
+        files = post_mock.call_args.kwargs['json']['files']
+        self.assertEqual([(file['path'], file['operation'], file['sha']) for file in files], [('mts_conf.cfg', 'update', 'old')])
+
+
+    def test_remove_stale_configs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write_operator_config({'mts': ['_[78]9337704444'], 'beeline': ['_[78]9337704XXX']}, temp_dir)
+
+            remove_stale_configs(temp_dir, {'mts': []})
+
+            self.assertEqual(os.listdir(temp_dir), ['mts_conf.cfg'])
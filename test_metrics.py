@@ -0,0 +1,174 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from main import optimize_parsed, parsing_rows
+from metrics import RunReport, collect_stages, finish_report, get_report, start_report, stage
+from profiling import profiling
+
+
+class TestRunReport(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(finish_report)
+
+
+    def test_nested_stages(self):
+        # arrange
+        report = RunReport({'strategy': 'passes'})
+
+        # act
+        with report.stage('optimize', 10) as outer:
+            with report.stage('mts') as inner:
+                inner.items_out = 3
+
+            outer.items_out = 5
+
+        # assert
+        self.assertEqual([metrics.name for metrics in report.stages], ['optimize/mts', 'optimize'], msg = 'Вложенные этапы получают полное имя')
+        self.assertEqual((report.stages[1].items_in, report.stages[1].items_out), (10, 5))
+        self.assertGreaterEqual(report.stages[1].wall, report.stages[0].wall)
+
+
+    def test_stage_recorded_on_error(self):
+        report = RunReport()
+
+        with self.assertRaises(ValueError):
+            with report.stage('parse'):
+                raise ValueError
+
+        self.assertEqual([metrics.name for metrics in report.stages], ['parse'], msg = 'Упавший этап тоже попадает в отчёт')
+
+
+    def test_collect_stages(self):
+        # arrange
+        report = start_report({})
+
+        # act
+        with collect_stages() as stages:
+            with stage('optimize/mts'):
+                pass
+
+        with stage('upload'):
+            report.extend(stages)
+
+        # assert
+        self.assertIs(get_report(), report)
+        self.assertEqual([metrics.name for metrics in report.stages], ['upload/optimize/mts', 'upload'])
+
+
+    def test_no_report_no_recording(self):
+        # arrange
+        finish_report()
+
+        # act
+        with self.assertLogs('App', level = 'INFO') as logs:
+            with stage('parse', 3) as metrics:
+                metrics.items_out = 2
+
+        # assert
+        self.assertIsNone(get_report(), msg = 'Вне main() этапы никуда не копятся')
+        self.assertIn('Stage parse', logs.records[0].getMessage(), msg = 'Замер всё равно попадает в лог')
+
+
+    def test_pass_stages_logged_at_info(self):
+        # arrange
+        start_report({})
+
+        # act
+        with self.assertLogs('App', level = 'INFO') as logs:
+            with stage('optimize/mts'):
+                with stage('cycle0/compress_sequential', 10) as metrics:
+                    metrics.items_out = 4
+
+        # assert
+        self.assertIn('Stage optimize/mts/cycle0/compress_sequential', logs.records[0].getMessage())
+        self.assertIn('10 -> 4 items', logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].funcName, 'test_pass_stages_logged_at_info', msg = 'В логе место вызова stage()')
+
+
+    def test_write(self):
+        # arrange
+        report = start_report({'workers': 1})
+        with stage('download') as metrics:
+            metrics.items_out = 100
+
+        report.status = 'ok'
+
+        # act
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'run_report.json')
+            report.write(path)
+
+            with open(path, encoding = 'utf-8') as f:
+                data = json.load(f)
+
+        # assert
+        self.assertEqual((data['status'], data['settings']), ('ok', {'workers': 1}))
+        self.assertEqual(data['stages'][0]['name'], 'download')
+        self.assertEqual(data['stages'][0]['items_out'], 100)
+        self.assertIn('cpu', data['stages'][0])
+
+
+    def test_optimizer_passes_per_operator(self):
+        # arrange
+        parsed = parsing_rows([
+            ['910', '0000000', '0000999', 'ПАО "МТС"', '7740000076'],
+            ['910', '0002000', '0002999', 'ПАО "МТС"', '7740000076'],
+        ], ['mts'])
+        report = start_report({})
+
+        # act
+        optimize_parsed(parsed, 'passes', 1)
+
+        # assert
+        names = [metrics.name for metrics in report.stages]
+        self.assertIn('group', names)
+        self.assertIn('optimize/mts', names)
+        self.assertIn('optimize/mts/cycle0/compress_sequential', names, msg = f'Нет замера прохода оптимизатора: {names}')
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(finish_report)
+
+
+    def test_cprofile_per_stage(self):
+        # arrange
+        start_report({})
+
+        # act
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with profiling('cprofile', temp_dir):
+                with stage('optimize/mts'):
+                    with stage('cycle0'):
+                        sorted(range(1000))
+
+            files = sorted(os.listdir(temp_dir))
+
+        # assert
+        self.assertEqual(files, ['optimize_mts.prof'], msg = 'Вложенный этап входит в профиль внешнего')
+
+
+    def test_sample_collapsed_stacks(self):
+        # arrange
+        start_report({})
+
+        # act
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with profiling('sample', temp_dir):
+                with stage('parse'):
+                    deadline = time.perf_counter() + 0.2
+                    while time.perf_counter() < deadline:
+                        pass
+
+            with open(os.path.join(temp_dir, 'stacks.collapsed'), encoding = 'utf-8') as f:
+                lines = f.read().splitlines()
+
+        # assert
+        self.assertTrue(lines, msg = 'Нет ни одного снимка стека')
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertTrue(stack.startswith('parse;'), msg = f'Корень стека - имя этапа: {stack}')
+        self.assertIn('test_sample_collapsed_stacks', stack)
+        self.assertGreater(int(count), 0)
@@ -1,3 +1,7 @@
+import json
+import os
+import random
+import re
 import unittest
 
 from optimized import (
@@ -5,10 +9,45 @@ from optimized import (
     merge_adjacent_ranges,
     merge_masks, 
     merge_similar_masks, 
+    X,
+    optimize_patterns_in_memory,
+    parse_ir,
     parse_pattern,
+    render_ir,
     sort_lines_by_def_code, split_mask
 )
 
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), 'testdata', 'optimizer_golden.json')
+
+
+def legacy_merge_masks(masks: list[list[str]]) -> list[list[str]]:
+    # Старый merge_masks на множествах строк - эталон для битовых масок
+    merged_mask = []
+    for i in range(len(masks[0])):
+        values = set()
+        for mask in masks:
+            if mask[i] == 'X':
+                values.update(str(d) for d in range(10))
+
+            elif mask[i].startswith('['):
+                start, end = map(int, re.match(r'\[(\d)-(\d)\]', mask[i]).groups())
+                values.update(str(d) for d in range(start, end + 1))
+
+            else:
+                values.add(mask[i])
+
+        if len(values) == 1:
+            merged_mask.append(next(iter(values)))
+            continue
+
+        digits = [int(v) for v in values]
+        if set(str(d) for d in range(min(digits), max(digits) + 1)) != values:
+            return masks
+
+        merged_mask.append(f'[{min(digits)}-{max(digits)}]')
+
+    return [merged_mask]
+
 
 class TestOptimized(unittest.TestCase):
     def test_parse_pattern(self):
@@ -207,6 +246,31 @@ class TestOptimized(unittest.TestCase):
         self.assertEqual(result[3], "other line")
 
 
+    def test_sort_lines_full_order(self):
+        # arrange
+        lines = [
+            "exten = _[78]9005XX,1,GoSub",
+            "exten = _[78]900[0-4]XX,1,GoSub",
+            "exten = _[78]111XXX,1,GoSub",
+            "exten = _[78]9006[5-9]X,1,GoSub",
+            "exten = _[78]90060X,1,GoSub",
+        ]
+        expected = [
+            "exten = _[78]111XXX,1,GoSub",
+            "exten = _[78]900[0-4]XX,1,GoSub",
+            "exten = _[78]9005XX,1,GoSub",
+            "exten = _[78]90060X,1,GoSub",
+            "exten = _[78]9006[5-9]X,1,GoSub",
+        ]
+
+        # act
+        results = [sort_lines_by_def_code(lines[shift:] + lines[:shift]) for shift in range(len(lines))]
+
+        # assert
+        for result in results:
+            self.assertEqual(result, expected, msg = 'Порядок внутри DEF-кода не должен зависеть от входа')
+
+
     def test_merge_adjacent_ranges_empty(self):
         # arrange
         patterns = []
@@ -241,3 +305,71 @@ class TestOptimized(unittest.TestCase):
         
         # assert
         self.assertEqual(len(result), 1)
+
+
+    def test_parse_ir(self):
+        # arrange
+        pattern = "exten = _[78]90[0-1]5XX,1,GoSub"
+
+        # act
+        result = parse_ir(pattern)
+
+        # assert
+        self.assertEqual(result.prefix, "90")
+        self.assertEqual(result.mask, (0b11, 1 << 5, X, X))
+        self.assertEqual(render_ir(result), pattern, 'Неизменённый шаблон отдаётся исходной строкой')
+
+
+    def test_parse_ir_invalid(self):
+        self.assertIsNone(parse_ir("invalid pattern string"))
+        self.assertIsNone(parse_ir("exten = _[78]XX,1,GoSub"))
+        self.assertIsNone(parse_ir("exten = _[78]12!X,1,GoSub"))
+
+
+class TestOptimizerGolden(unittest.TestCase):
+    def test_merge_masks_same_as_legacy(self):
+        # Случайные маски из цифр, X и диапазонов, в том числе несливаемые
+        rnd = random.Random(12)
+        tokens = ['X'] + [str(d) for d in range(10)] + [f'[{a}-{b}]' for a in range(10) for b in range(a + 1, 10)]
+        for _ in range(5000):
+            width = rnd.randint(1, 4)
+            masks = [[rnd.choice(tokens) for _ in range(width)] for _ in range(rnd.randint(1, 4))]
+
+            self.assertEqual(merge_masks(masks), legacy_merge_masks(masks), msg = f'{masks}')
+
+
+    def test_same_as_string_optimizer(self):
+        # Эталон снят со строкового оптимизатора на выгрузках синтетического реестра.
+        # Тот сортировал только по DEF-коду, поэтому сравниваем с эталоном в полном порядке
+        with open(GOLDEN_FILE, 'r', encoding = 'utf-8') as f:
+            cases = json.load(f)
+
+        for case in cases:
+            patterns = [f'exten = _[78]{body},1,GoSub' for body in case['input']]
+            for lvl, expected in case['expected'].items():
+                # act
+                result = optimize_patterns_in_memory(patterns, int(lvl))
+
+                # assert
+                self.assertEqual(
+                    result,
+                    sort_lines_by_def_code([f'exten = _[78]{body},1,GoSub(${{ARG1}},${{EXTEN}},1)' for body in expected]),
+                    msg = f'{case["name"]}, уровень {lvl}'
+                )
+
+
+    def test_converges_to_fixed_point(self):
+        # На эталонных выгрузках второй и третий уровни уже совпадают, сходимость должна дать то же
+        with open(GOLDEN_FILE, 'r', encoding = 'utf-8') as f:
+            cases = json.load(f)
+
+        for case in cases:
+            patterns = [f'exten = _[78]{body},1,GoSub' for body in case['input']]
+
+            # act
+            result = optimize_patterns_in_memory(patterns)
+            capped = optimize_patterns_in_memory(patterns, max_cycles = 1)
+
+            # assert
+            self.assertEqual(result, optimize_patterns_in_memory(patterns, 3), msg = case['name'])
+            self.assertEqual(capped, optimize_patterns_in_memory(patterns, 1), msg = 'Предел циклов должен соблюдаться')
@@ -0,0 +1,195 @@
+import random
+import re
+import unittest
+from itertools import product
+
+from ranges import coalesce_intervals, cover_range, decompose_range, minimal_patterns, render_pattern
+
+
+def legacy_decompose(start_input: str, end_input: str) -> list[str]:
+    # Старый range_of_numbers без обёртки в PatternLine - эталон для сравнения
+    start = start_input.zfill(7)
+    end = end_input.zfill(7)
+
+    if start == end:
+        return [start]
+
+    same_numbers = []
+    for i in range(7):
+        if start[i] == end[i]:
+            same_numbers.append(start[i])
+        else:
+            break
+
+    numbers = ''.join(same_numbers)
+    n = len(numbers)
+    stack = [(numbers, start[n:], end[n:])]
+    patterns = []
+
+    while stack:
+        current_common, s_rest, e_rest = stack.pop(0)
+
+        if not s_rest and not e_rest:
+            patterns.append(current_common)
+            continue
+
+        if (s_rest[1:] == '0' * len(s_rest[1:]) and
+            e_rest[1:] == '9' * len(e_rest[1:])):
+
+            if s_rest[0] == e_rest[0]:
+                patterns.append(current_common + s_rest[0] + 'X' * len(s_rest[1:]))
+            else:
+                patterns.append(current_common + f'[{s_rest[0]}-{e_rest[0]}]' + 'X' * len(s_rest[1:]))
+
+        else:
+            start_current = int(s_rest[0])
+            end_current = int(e_rest[0])
+
+            if start_current != 9:
+                stack.append((current_common + str(start_current), s_rest[1:], '9' * len(s_rest[1:])))
+
+            for d in range(start_current + 1, end_current):
+                stack.append((current_common + str(d), '0' * len(s_rest[1:]), '9' * len(s_rest[1:])))
+
+            if end_current != 0:
+                stack.append((current_common + str(end_current), '0' * len(s_rest[1:]), e_rest[1:]))
+
+    return [pattern.replace('[0-9]', 'X') for pattern in patterns]
+
+
+def expand(pattern: str) -> list[int]:
+    # Перебор всех номеров, которые покрывает шаблон
+    choices = []
+    for token in re.findall(r'\[\d-\d\]|X|\d', pattern):
+        if token == 'X':
+            choices.append('0123456789')
+        elif token.startswith('['):
+            choices.append(''.join(str(d) for d in range(int(token[1]), int(token[3]) + 1)))
+        else:
+            choices.append(token)
+
+    return [int(''.join(digits)) for digits in product(*choices)]
+
+
+def pattern_bounds(pattern: str) -> tuple[int, int]:
+    # Шаблоны разложения - цифры, максимум один класс и X в хвосте, то есть сплошной интервал
+    low = re.sub(r'\[(\d)-\d\]', r'\1', pattern).replace('X', '0')
+    high = re.sub(r'\[\d-(\d)\]', r'\1', pattern).replace('X', '9')
+    return int(low), int(high)
+
+
+def covers_exactly(patterns: list[str], start: int, end: int) -> bool:
+    bounds = sorted(pattern_bounds(pattern) for pattern in patterns)
+    expected = start
+    for low, high in bounds:
+        if low != expected:
+            return False
+        expected = high + 1
+
+    return expected == end + 1
+
+
+class TestDecomposeRange(unittest.TestCase):
+    def test_brute_force_small_widths(self):
+        # Все диапазоны для 2 цифр и случайные для 3-4 цифр против полного перебора
+        rnd = random.Random(8)
+        cases = [(s, e, 2) for s in range(100) for e in range(s, 100)]
+        for width, count in ((3, 3000), (4, 400)):
+            for _ in range(count):
+                a, b = sorted(rnd.randrange(10 ** width) for _ in range(2))
+                cases.append((a, b, width))
+
+        for start, end, width in cases:
+            patterns = decompose_range(start, end, width)
+            numbers = [number for pattern in patterns for number in expand(pattern)]
+
+            self.assertEqual(sorted(numbers), list(range(start, end + 1)), msg = f'{start}-{end}: {patterns}')
+            self.assertTrue(all(len(re.findall(r'\[\d-\d\]|X|\d', p)) == width for p in patterns))
+
+
+    def test_same_as_legacy(self):
+        # Случайные и выровненные по блокам диапазоны, как в реальном реестре
+        rnd = random.Random(7)
+        cases = []
+        for _ in range(5000):
+            a, b = sorted(rnd.randrange(10 ** 7) for _ in range(2))
+            cases.append((a, b))
+
+            block = 10 ** rnd.randint(2, 6)
+            start = rnd.randrange(10 ** 7 // block) * block
+            cases.append((start, min(start + block * rnd.randint(1, 30) - 1, 10 ** 7 - 1)))
+
+        legacy_bugs = 0
+        for start, end in cases:
+            legacy = legacy_decompose(str(start), str(end))
+            if not covers_exactly(legacy, start, end):
+                legacy_bugs += 1
+                continue
+
+            self.assertEqual(decompose_range(start, end, 7), legacy, msg = f'{start}-{end}')
+
+        self.assertLess(legacy_bugs, len(cases))
+
+
+    def test_fixes_legacy_overcoverage(self):
+        # Старый код отдавал 29XXXXX и захватывал чужие номера 2900000-2949999
+        patterns = decompose_range(2950000, 3049999, 7)
+
+        self.assertTrue(covers_exactly(patterns, 2950000, 3049999))
+        self.assertFalse(covers_exactly(legacy_decompose('2950000', '3049999'), 2950000, 3049999))
+
+
+    def test_wide_numbers(self):
+        patterns = decompose_range(123456789, 987654321, 10)
+
+        self.assertTrue(covers_exactly(patterns, 123456789, 987654321))
+
+
+    def test_bad_range(self):
+        with self.assertRaises(ValueError):
+            decompose_range(5, 4)
+
+        with self.assertRaises(ValueError):
+            decompose_range(0, 10 ** 7)
+
+
+class TestMinimalPatterns(unittest.TestCase):
+    def test_coalesce_intervals(self):
+        intervals = [(10, 19), (0, 9), (30, 39), (35, 50), (52, 60)]
+
+        self.assertEqual(coalesce_intervals(intervals), [(0, 19), (30, 50), (52, 60)])
+
+
+    def test_cover_range_brute_force(self):
+        # Покрытие точное и не длиннее разложения старым способом
+        rnd = random.Random(9)
+        for _ in range(2000):
+            start, end = sorted(rnd.randrange(10 ** 4) for _ in range(2))
+            patterns = [render_pattern(pattern) for pattern in cover_range(start, end, 4)]
+            numbers = [number for pattern in patterns for number in expand(pattern)]
+
+            self.assertEqual(numbers, list(range(start, end + 1)), msg = f'{start}-{end}: {patterns}')
+            self.assertLessEqual(len(patterns), len(decompose_range(start, end, 4)))
+
+
+    def test_minimal_patterns_brute_force(self):
+        rnd = random.Random(10)
+        for _ in range(300):
+            intervals = []
+            for _ in range(rnd.randint(1, 8)):
+                start = rnd.randrange(10 ** 4)
+                intervals.append((start, min(start + rnd.choice((0, 9, 99, 999, rnd.randrange(3000))), 9999)))
+
+            expected = sorted({number for start, end in intervals for number in range(start, end + 1)})
+            patterns = minimal_patterns(intervals, 4)
+            numbers = [number for pattern in patterns for number in expand(pattern)]
+
+            self.assertEqual(sorted(numbers), expected, msg = f'{intervals}: {patterns}')
+            self.assertEqual(len(numbers), len(expected), msg = 'Шаблоны не должны пересекаться')
+
+
+    def test_merge_across_def_codes(self):
+        # Один и тот же блок в соседних DEF-кодах сворачивается в класс
+        intervals = [(9000000000, 9000999999), (9010000000, 9010999999), (9020000000, 9020999999)]
+
+        self.assertEqual(minimal_patterns(intervals, 10), ['90[0-2]0XXXXXX'])
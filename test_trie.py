@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from ranges import decompose_range, minimal_patterns
+from test_ranges import expand
+from trie import DigitTrie, digit_runs, trie_patterns
+
+
+class TestDigitTrie(unittest.TestCase):
+    def test_brute_force(self):
+        # Покрытие точное, без пересечений и не длиннее merged
+        rnd = random.Random(13)
+        for _ in range(300):
+            intervals = []
+            for _ in range(rnd.randint(1, 8)):
+                start = rnd.randrange(10 ** 4)
+                intervals.append((start, min(start + rnd.choice((0, 9, 99, 999, rnd.randrange(3000))), 9999)))
+
+            expected = sorted({number for start, end in intervals for number in range(start, end + 1)})
+            patterns = trie_patterns(intervals, 4)
+            numbers = [number for pattern in patterns for number in expand(pattern)]
+
+            self.assertEqual(sorted(numbers), expected, msg = f'{intervals}: {patterns}')
+            self.assertEqual(len(numbers), len(expected), msg = 'Шаблоны не должны пересекаться')
+            self.assertLessEqual(len(patterns), len(minimal_patterns(intervals, 4)))
+
+
+    def test_single_range_not_worse_than_decompose(self):
+        rnd = random.Random(14)
+        for _ in range(1000):
+            start, end = sorted(rnd.randrange(10 ** 7) for _ in range(2))
+
+            self.assertLessEqual(len(trie_patterns([(start, end)], 7)), len(decompose_range(start, end, 7)))
+
+
+    def test_merge_across_def_codes(self):
+        # Один и тот же блок в соседних DEF-кодах - одно общее поддерево
+        intervals = [(9020000000, 9020999999), (9000000000, 9000999999), (9010000000, 9010999999)]
+
+        self.assertEqual(trie_patterns(intervals, 10), ['90[0-2]0XXXXXX'])
+
+
+    def test_shared_subtrees(self):
+        # arrange
+        trie = DigitTrie(4)
+
+        # act
+        for def_code in range(10):
+            trie.insert(def_code * 1000 + 120, def_code * 1000 + 345)
+
+        # assert
+        self.assertEqual(trie.patterns(), ['X1[2-9]X', 'X2XX', 'X3[0-3]X', 'X34[0-5]'])
+        self.assertEqual(len(set(trie._nodes[trie.root])), 1, msg = 'Одинаковые поддеревья хранятся один раз')
+
+
+    def test_order_and_overlap_do_not_matter(self):
+        intervals = [(100, 250), (200, 399), (0, 99), (380, 420)]
+
+        self.assertEqual(trie_patterns(intervals, 3), trie_patterns(reversed(intervals), 3))
+        self.assertEqual(trie_patterns(intervals, 3), ['[0-3]XX', '4[0-1]X', '420'])
+
+
+    def test_bad_range(self):
+        with self.assertRaises(ValueError):
+            DigitTrie(3).insert(5, 4)
+
+        with self.assertRaises(ValueError):
+            DigitTrie(3).insert(0, 1000)
+
+
+    def test_digit_runs(self):
+        self.assertEqual(digit_runs(0b1110001101), [(0, 0), (2, 3), (7, 9)])
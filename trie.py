@@ -0,0 +1,125 @@
+from typing import Iterable
+
+
+EMPTY = 0 # Ни одного номера в поддереве
+FULL = 1 # Все номера поддерева, рисуется хвостом из X
+
+
+class DigitTrie:
+    """
+    Дерево цифр номера с общими поддеревьями: узел - кортеж из 10 номеров
+    детей, одинаковые кортежи хранятся один раз. Полностью заполненный
+    узел сразу превращается в FULL, поэтому свёртка в X идёт снизу вверх
+    уже при вставке, а одинаковые хвосты соседних цифр сливаются в [a-b] при обходе.
+    """
+    __slots__ = ('width', 'root', '_nodes', '_ids')
+
+    def __init__(self, width: int):
+        self.width = width
+        self.root = EMPTY
+        self._nodes: list[tuple[int, ...]] = [(), ()] # 0 и 1 заняты под EMPTY и FULL
+        self._ids: dict[tuple[int, ...], int] = {}
+
+    def insert(self, start: int, end: int) -> None:
+        if start < 0 or start > end or end >= 10 ** self.width:
+            raise ValueError(f'Bad range {start}-{end} for {self.width} digits')
+
+        self.root = self._insert(self.root, start, end, self.width)
+
+    def _insert(self, node: int, low: int, high: int, width: int) -> int:
+        if node == FULL or (low == 0 and high == 10 ** width - 1):
+            return FULL
+
+        unit = 10 ** (width - 1) # Вес текущего разряда
+        children = list(self._nodes[node]) if node != EMPTY else [EMPTY] * 10
+        for digit in range(low // unit, high // unit + 1):
+            base = digit * unit
+            children[digit] = self._insert(children[digit], max(low, base) - base, min(high, base + unit - 1) - base, width - 1)
+
+        return self._node(tuple(children))
+
+    def _node(self, children: tuple[int, ...]) -> int:
+        if all(child == FULL for child in children):
+            return FULL
+
+        node = self._ids.get(children)
+        if node is None:
+            node = self._ids[children] = len(self._nodes)
+            self._nodes.append(children)
+
+        return node
+
+    def patterns(self) -> list[str]:
+        # Шаблоны идут по первой цифре, общие поддеревья рисуются один раз
+        if self.root == EMPTY:
+            return []
+
+        return self._render(self.root, self.width, {})
+
+    def _render(self, node: int, width: int, memo: dict[tuple[int, int], list[str]]) -> list[str]:
+        if node == FULL:
+            return ['X' * width]
+
+        key = (node, width)
+        if key in memo:
+            return memo[key]
+
+        # Одинаковый хвост у нескольких цифр - одна строка с классом цифр вместо нескольких
+        digits_by_suffix: dict[str, int] = {}
+        for digit, child in enumerate(self._nodes[node]):
+            if child != EMPTY:
+                for suffix in self._render(child, width - 1, memo):
+                    digits_by_suffix[suffix] = digits_by_suffix.get(suffix, 0) | 1 << digit
+
+        ordered = []
+        for order, (suffix, digits) in enumerate(digits_by_suffix.items()):
+            for low, high in digit_runs(digits):
+                ordered.append((low, order, digit_token(low, high) + suffix))
+
+        ordered.sort()
+        result = [pattern for _, _, pattern in ordered]
+
+        memo[key] = result
+        return result
+
+
+def digit_runs(digits: int) -> list[tuple[int, int]]:
+    # Битовая маска цифр -> сплошные отрезки (low, high)
+    runs = []
+    digit = 0
+    while digits:
+        if digits & 1:
+            low = digit
+            while digits & 2:
+                digits >>= 1
+                digit += 1
+
+            runs.append((low, digit))
+
+        digits >>= 1
+        digit += 1
+
+    return runs
+
+
+def digit_token(low: int, high: int) -> str:
+    if low == high:
+        return str(low)
+
+    if low == 0 and high == 9:
+        return 'X'
+
+    return f'[{low}-{high}]'
+
+
+def trie_patterns(intervals: Iterable[tuple[int, int]], width: int) -> list[str]:
+    """
+    Стратегия trie: все интервалы оператора в одно дерево цифр и один обход.
+    Результат не зависит от порядка и пересечений интервалов, повторных
+    проходов как у optimize_patterns_in_memory не нужно.
+    """
+    trie = DigitTrie(width)
+    for start, end in intervals:
+        trie.insert(start, end)
+
+    return trie.patterns()